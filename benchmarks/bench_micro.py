@@ -0,0 +1,145 @@
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from typing import Callable, Dict, List
+
+from benchmarks.fakes import fake_embedding, setup_offline_env
+
+SAMPLE_TEXTS = [
+    "I can't sleep again, my head keeps replaying the argument with my sister.",
+    "how are you?",
+    "Non riesco a dormire, penso sempre alle stesse cose. Come va?",
+    "Мне одиноко в последнее время, никто не пишет. Как дела у тебя?",
+    "Work has been crushing me lately, I come home and just stare at the wall for hours.",
+]
+
+SAMPLE_REPLY = (
+    "I understand how heavy this feels. You have been carrying a lot. "
+    "It makes sense that you feel drained by it. You have been carrying a lot. "
+    "Maybe tonight you could write down the one thing that is loudest in your head. "
+    "Would that feel doable? Or maybe a short walk could help, even five minutes outside."
+)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Microbenchmarks for hot-path helpers.")
+    ap.add_argument("--repeat", type=int, default=5, help="timing rounds; the best round is reported")
+    ap.add_argument("--number", type=int, default=2000, help="calls per round")
+    ap.add_argument("--matches", type=int, default=96, help="matches fed to the get_relevant_history scorer")
+    ap.add_argument("--dimension", type=int, default=256)
+    ap.add_argument("--json", action="store_true")
+    return ap.parse_args(argv)
+
+
+def bench(fn: Callable[[], object], number: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / number)
+    return best
+
+
+def abench(loop: asyncio.AbstractEventLoop, fn: Callable[[], object], number: int, repeat: int) -> float:
+    async def rounds() -> float:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for _ in range(number):
+                await fn()
+            best = min(best, (time.perf_counter() - t0) / number)
+        return best
+
+    return loop.run_until_complete(rounds())
+
+
+def legacy_flags(pb, text: str, fallback: str = "en"):
+    t = text.lower()
+    if re.search(r"[\u0400-\u04FF]", t):
+        lang = "ru"
+    elif re.search(r"\b(come|stai|sto|va|grazie|perch[eè]|quest[oa]|aiuto|cosa|penso|sent[io])\b", t):
+        lang = "it"
+    else:
+        lang = fallback if not isinstance(text, str) else "en"
+    smalltalk = re.search(pb._SMALLTALK_PATTERNS.get(lang, pb._SMALLTALK_PATTERNS["en"]), text.lower()) is not None
+    return lang, smalltalk, re.search(pb._SAFETY_PATTERN, text, re.IGNORECASE) is not None
+
+
+class _StaticStore:
+    def __init__(self, matches: List[Dict]):
+        self._res = {"matches": matches}
+
+    async def query(self, *args, **kwargs):
+        return self._res
+
+
+def make_matches(n: int, dimension: int) -> List[Dict]:
+    rng = random.Random(3)
+    now = time.time()
+    matches = []
+    for i in range(n):
+        text = f"{rng.choice(SAMPLE_TEXTS)} #{i}"
+        matches.append({
+            "id": f"bench-{i}",
+            "score": rng.uniform(0.2, 0.95),
+            "metadata": {
+                "role": "user" if i % 2 else "assistant",
+                "text": text,
+                "timestamp": str(now - rng.uniform(0, 14 * 24 * 3600)),
+                "chat_id": "1",
+            },
+            "values": fake_embedding(text, dimension),
+        })
+    return matches
+
+
+def run(args) -> Dict[str, float]:
+    logging.disable(logging.INFO)
+    setup_offline_env(dimension=args.dimension)
+    import memory_pinecone
+    import psychologist_bot as pb
+
+    n, r = args.number, args.repeat
+    results: Dict[str, float] = {}
+    results["_shrink_reply"] = bench(lambda: pb._shrink_reply(SAMPLE_REPLY), n, r)
+    results["_detect_msg_lang"] = bench(lambda: [pb._detect_msg_lang(t) for t in SAMPLE_TEXTS], n, r) / len(SAMPLE_TEXTS)
+    results["_is_smalltalk"] = bench(
+        lambda: [pb._is_smalltalk(t, lang) for t in SAMPLE_TEXTS for lang in ("en", "ru", "it")], n, r,
+    ) / (len(SAMPLE_TEXTS) * 3)
+    results["message_flags[before]"] = bench(lambda: [legacy_flags(pb, t) for t in SAMPLE_TEXTS], n, r) / len(SAMPLE_TEXTS)
+    results["message_flags[after]"] = bench(lambda: [pb.classify_message(t) for t in SAMPLE_TEXTS], n, r) / len(SAMPLE_TEXTS)
+    results["menu_keyboard[before]"] = bench(lambda: pb.menu_keyboard.__wrapped__("en"), n, r)
+    results["menu_keyboard[after]"] = bench(lambda: pb.menu_keyboard("en"), n, r)
+
+    memory_pinecone._store = _StaticStore(make_matches(args.matches, args.dimension))
+    emb = fake_embedding("query", args.dimension)
+    loop = asyncio.new_event_loop()
+    try:
+        results[f"get_relevant_history[{args.matches}]"] = abench(
+            loop, lambda: memory_pinecone.get_relevant_history("1", "query", 5, 4000, 0.3, emb=emb), max(1, n // 10), r,
+        )
+    finally:
+        loop.close()
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    if args.json:
+        json.dump({k: v * 1e6 for k, v in results.items()}, sys.stdout, indent=2)
+        print()
+        return
+    print(f"{'benchmark':<34}{'µs/op':>10}")
+    for name, seconds in results.items():
+        print(f"{name:<34}{seconds * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
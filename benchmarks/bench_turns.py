@@ -0,0 +1,188 @@
+import sys
+import json
+import logging
+import random
+import asyncio
+import argparse
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from benchmarks.fakes import (
+    CountingStore, FakeOpenAI, make_callback, make_fake_session, make_message,
+    now, percentiles, setup_offline_env,
+)
+
+MESSAGES = [
+    "I can't sleep again, my head keeps replaying the argument with my sister.",
+    "I feel anxious about the exam tomorrow and I can't focus at all.",
+    "how are you?",
+    "Work has been crushing me lately, I come home and just stare at the wall.",
+    "Non riesco a dormire, penso sempre alle stesse cose.",
+    "Мне одиноко в последнее время, никто не пишет.",
+    "I finally went for a walk today like you suggested, it helped a bit.",
+    "Sometimes I wonder if anyone would notice if I just disappeared for a while.",
+    "My partner and I keep fighting about small things and I feel exhausted.",
+    "come stai?",
+]
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Offline load test for the full on_text / on_callbacks pipeline.")
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--turns", type=int, default=5, help="turns per chat")
+    ap.add_argument("--think", type=float, default=0.0, help="pause between a reply and the next message (s)")
+    ap.add_argument("--burst", type=int, default=1, help="messages sent back-to-back per turn")
+    ap.add_argument("--callback-every", type=int, default=3, help="press 'recent' every N turns (0 = never)")
+    ap.add_argument("--dimension", type=int, default=256)
+    ap.add_argument("--embed-latency", type=float, default=0.05)
+    ap.add_argument("--chat-latency", type=float, default=0.8)
+    ap.add_argument("--vector-latency", type=float, default=0.0)
+    ap.add_argument("--telegram-latency", type=float, default=0.03)
+    ap.add_argument("--stream", action="store_true")
+    ap.add_argument("--shards", type=int, default=0, help="route messages through an in-process LocalShardRouter")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", action="store_true", help="print the report as JSON")
+    ap.add_argument("--verbose", action="store_true", help="keep per-turn INFO logs")
+    return ap.parse_args(argv)
+
+
+async def run(args) -> Dict:
+    random.seed(args.seed)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    overrides = {"STREAM_REPLIES": "1", "STREAM_EDIT_INTERVAL_SEC": "1"} if args.stream else {}
+    setup_offline_env(dimension=args.dimension, **overrides)
+
+    from aiogram import Bot
+    import memory_pinecone
+    import psychologist_bot as pb
+    import scheduler
+    from sharding import LocalShardRouter, shard_for
+
+    oa = FakeOpenAI(args.dimension, args.embed_latency, args.chat_latency)
+    memory_pinecone._oa = oa
+    pb.oa = oa
+    store = CountingStore(memory_pinecone.get_store(), args.vector_latency)
+    memory_pinecone._store = store
+    session = make_fake_session(args.telegram_latency)
+    bot = Bot(token="42:BENCH", session=session)
+
+    stage_samples: Dict[str, List[float]] = defaultdict(list)
+
+    class RecordingTimer(pb.TurnTimer):
+        def finish(self, kind: str) -> str:
+            for name, value in self.stages.items():
+                stage_samples[name].append(value)
+            stage_samples["turn"].append(self.total())
+            return super().finish(kind)
+
+    pb.TurnTimer = RecordingTimer
+    e2e: List[float] = []
+    sent = Counter()
+    handled: Dict[int, List] = defaultdict(list)
+    routed = Counter()
+    router = None
+    if args.shards:
+        def shard_handler(shard: int):
+            async def handle(update: Dict):
+                chat_id = update["message"]["chat"]["id"]
+                handled[chat_id].append((shard, update["update_id"]))
+                await pb.on_text(make_message(bot, chat_id, update["message"]["text"]), bot)
+            return handle
+
+        router = LocalShardRouter([shard_handler(i) for i in range(args.shards)])
+    update_ids = iter(range(1, 1 << 62))
+
+    async def send(chat_id: int, text: str):
+        if router is None:
+            await pb.on_text(make_message(bot, chat_id, text), bot)
+            return
+        router.route({"update_id": next(update_ids), "message": {"chat": {"id": chat_id}, "text": text}})
+        routed[chat_id] += 1
+        while len(handled[chat_id]) < routed[chat_id]:
+            await asyncio.sleep(0.001)
+
+    async def chat_session(chat_id: int):
+        for turn in range(args.turns):
+            t0 = now()
+            for _ in range(args.burst):
+                await send(chat_id, random.choice(MESSAGES))
+                sent["messages"] += 1
+            while pb.coalescer.busy(chat_id):
+                await asyncio.sleep(0.001)
+            e2e.append(now() - t0)
+            if args.callback_every and (turn + 1) % args.callback_every == 0:
+                t0 = now()
+                await pb.on_callbacks(make_callback(bot, chat_id, "recent"), bot)
+                stage_samples["callback"].append(now() - t0)
+                sent["callbacks"] += 1
+            if args.think:
+                await asyncio.sleep(args.think)
+
+    await pb.startup()
+    started = now()
+    await asyncio.gather(*(chat_session(10_000 + i) for i in range(args.chats)))
+    if router is not None:
+        await router.drain()
+    await pb.coalescer.drain()
+    elapsed = now() - started
+    await pb.shutdown()
+
+    turns = max(1, len(stage_samples["turn"]))
+    calls = Counter()
+    calls.update({f"openai.{k}": v for k, v in oa.calls.items()})
+    calls.update({f"vector.{k}": v for k, v in store.calls.items()})
+    calls.update({f"telegram.{k}": v for k, v in session.calls.items()})
+    return {
+        "config": vars(args),
+        "elapsed_sec": elapsed,
+        "messages": sent["messages"],
+        "turns": turns,
+        "callbacks": sent["callbacks"],
+        "throughput_turns_per_sec": turns / elapsed if elapsed else 0.0,
+        "e2e": percentiles(e2e),
+        "stages": {name: percentiles(values) for name, values in sorted(stage_samples.items())},
+        "calls_per_turn": {k: v / turns for k, v in sorted(calls.items())},
+        "embedding_cache": memory_pinecone.embedding_cache_stats(),
+        "sharding": None if router is None else {
+            "routed": router.routed,
+            "misrouted": sum(s != shard_for(c, args.shards) for c, seen in handled.items() for s, _ in seen),
+            "out_of_order": sum(
+                any(a[1] > b[1] for a, b in zip(seen, seen[1:])) for seen in handled.values()
+            ),
+        },
+        "admissions": {
+            d: sum(scheduler.ADMISSIONS.value(lane=name, decision=d) for name in scheduler.LANES.values())
+            for d in (scheduler.NORMAL, scheduler.DEGRADED, scheduler.SHED)
+        },
+    }
+
+
+def print_report(report: Dict):
+    print(f"turns={report['turns']} messages={report['messages']} callbacks={report['callbacks']} "
+          f"elapsed={report['elapsed_sec']:.2f}s throughput={report['throughput_turns_per_sec']:.1f} turns/s")
+    print(f"{'stage':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = dict(report["stages"], e2e=report["e2e"])
+    for name, p in rows.items():
+        print(f"{name:<12}{p['p50'] * 1000:>10.1f}{p['p95'] * 1000:>10.1f}{p['p99'] * 1000:>10.1f}")
+    print("calls per turn:")
+    for name, value in report["calls_per_turn"].items():
+        print(f"  {name:<34}{value:>8.2f}")
+    print(f"embedding cache: {report['embedding_cache']}")
+    print(f"admissions: {report['admissions']}")
+    if report["sharding"] is not None:
+        print(f"sharding: {report['sharding']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, default=str)
+        print()
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import tempfile
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def setup_offline_env(dimension: int = 256, **overrides: str) -> str:
+    data_dir = tempfile.mkdtemp(prefix="bot-bench-")
+    defaults = {
+        "OPENAI_API_KEY": "bench",
+        "TELEGRAM_TOKEN": "42:BENCH",
+        "VECTOR_BACKEND": "local",
+        "DATA_DIR": data_dir,
+        "DIMENSION": str(dimension),
+        "COALESCE_WINDOW_SEC": "0",
+        "USER_RATE_PER_MIN": "0",
+        "PERSIST_FLUSH_SEC": "0.05",
+    }
+    defaults.update(overrides)
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    return data_dir
+
+
+def fake_embedding(text: str, dimension: int) -> List[float]:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dimension).astype(np.float32).tolist()
+
+
+class Latency:
+    def __init__(self, mean: float, jitter: float = 0.0):
+        self.mean = mean
+        self.jitter = jitter
+
+    async def wait(self):
+        if self.mean > 0:
+            await asyncio.sleep(max(0.0, random.gauss(self.mean, self.jitter)))
+
+
+class _Embeddings:
+    def __init__(self, owner: "FakeOpenAI"):
+        self._owner = owner
+
+    async def create(self, model: str, input: List[str], **kwargs):
+        self._owner.calls["embeddings"] += 1
+        self._owner.calls["embedded_texts"] += len(input)
+        await self._owner.embed_latency.wait()
+        dim = kwargs.get("dimensions") or self._owner.dimension
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=fake_embedding(t, dim)) for i, t in enumerate(input)
+        ])
+
+
+class _Stream:
+    def __init__(self, words: List[str], latency: Latency):
+        self._words = words
+        self._latency = latency
+        self._closed = False
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        per_token = self._latency.mean / max(1, len(self._words))
+        for w in self._words:
+            if self._closed:
+                return
+            await asyncio.sleep(per_token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=w + " "))])
+
+    async def close(self):
+        self._closed = True
+
+
+class _Completions:
+    REPLY = (
+        "That sounds really heavy, and it makes sense you feel worn down. "
+        "You have been carrying a lot on your own. "
+        "Would it help to name the one thing weighing on you most tonight?"
+    )
+
+    def __init__(self, owner: "FakeOpenAI"):
+        self._owner = owner
+
+    async def create(self, model: str, messages: List[Dict[str, Any]], stream: bool = False, **kwargs):
+        self._owner.calls["chat"] += 1
+        self._owner.calls["prompt_chars"] += sum(len(m.get("content") or "") for m in messages)
+        if stream:
+            await asyncio.sleep(self._owner.first_token_latency)
+            return _Stream(self.REPLY.split(), self._owner.chat_latency)
+        await self._owner.chat_latency.wait()
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages) // 4, completion_tokens=40)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.REPLY))],
+            usage=usage,
+            model=model,
+        )
+
+
+class FakeOpenAI:
+    def __init__(
+        self,
+        dimension: int,
+        embed_latency: float = 0.05,
+        chat_latency: float = 0.8,
+        first_token_latency: float = 0.3,
+        jitter: float = 0.2,
+    ):
+        self.dimension = dimension
+        self.embed_latency = Latency(embed_latency, embed_latency * jitter)
+        self.chat_latency = Latency(chat_latency, chat_latency * jitter)
+        self.first_token_latency = first_token_latency
+        self.calls: Counter = Counter()
+        self.embeddings = _Embeddings(self)
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    async def close(self):
+        pass
+
+
+class CountingStore:
+    def __init__(self, inner, latency: float = 0.0):
+        self._inner = inner
+        self.latency = Latency(latency, latency * 0.2)
+        self.calls: Counter = Counter()
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    async def upsert(self, vectors, *args, **kwargs):
+        self.calls["upsert"] += 1
+        self.calls["upserted_vectors"] += len(vectors)
+        await self.latency.wait()
+        return await self._inner.upsert(vectors, *args, **kwargs)
+
+    async def query(self, *args, **kwargs):
+        self.calls["query"] += 1
+        await self.latency.wait()
+        return await self._inner.query(*args, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        self.calls["delete"] += 1
+        await self.latency.wait()
+        return await self._inner.delete(*args, **kwargs)
+
+    async def drop_namespace(self, *args, **kwargs):
+        self.calls["drop_namespace"] += 1
+        await self.latency.wait()
+        return await self._inner.drop_namespace(*args, **kwargs)
+
+
+def make_fake_session(latency: float = 0.03):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import Chat, Message
+
+    class FakeTelegramSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.latency = Latency(latency, latency * 0.2)
+            self.calls: Counter = Counter()
+            self._next_id = 1000
+
+        async def make_request(self, bot, method, timeout: Optional[int] = None):
+            self.calls[type(method).__name__] += 1
+            await self.latency.wait()
+            if isinstance(method, SendMessage):
+                self._next_id += 1
+                return Message(
+                    message_id=self._next_id,
+                    date=datetime.now(timezone.utc),
+                    chat=Chat(id=int(method.chat_id), type="private"),
+                    text=method.text,
+                )
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            for chunk in ():
+                yield chunk
+
+        async def close(self):
+            pass
+
+    return FakeTelegramSession()
+
+
+_update_ids = iter(range(1, 1 << 62))
+
+
+def make_message(bot, chat_id: int, text: str, user_id: Optional[int] = None):
+    from aiogram.types import Chat, Message, User
+
+    user_id = user_id if user_id is not None else chat_id
+    return Message(
+        message_id=next(_update_ids),
+        date=datetime.now(timezone.utc),
+        chat=Chat(id=chat_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="bench"),
+        text=text,
+    ).as_(bot)
+
+
+def make_callback(bot, chat_id: int, data: str, user_id: Optional[int] = None):
+    from aiogram.types import CallbackQuery, User
+
+    user_id = user_id if user_id is not None else chat_id
+    return CallbackQuery(
+        id=str(next(_update_ids)),
+        from_user=User(id=user_id, is_bot=False, first_name="bench"),
+        chat_instance="bench",
+        message=make_message(bot, chat_id, "menu", user_id),
+        data=data,
+    ).as_(bot)
+
+
+def percentiles(samples: List[float], points=(50, 95, 99)) -> Dict[str, float]:
+    if not samples:
+        return {f"p{p}": 0.0 for p in points}
+    arr = np.asarray(samples, dtype=np.float64)
+    return {f"p{p}": float(np.percentile(arr, p)) for p in points}
+
+
+def now() -> float:
+    return time.perf_counter()
@@ -0,0 +1,64 @@
+import os
+import logging
+from typing import Optional
+
+import aiohttp
+import httpx
+from openai import AsyncOpenAI
+
+from rate_limit import TokenBucket
+from scheduler import PriorityGate
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "32"))
+VECTOR_CONCURRENCY = int(os.getenv("VECTOR_CONCURRENCY", "32"))
+OPENAI_RPS = float(os.getenv("OPENAI_RPS", "0"))
+OPENAI_BURST = float(os.getenv("OPENAI_BURST", "20"))
+
+_openai: Optional[AsyncOpenAI] = None
+_session: Optional[aiohttp.ClientSession] = None
+
+openai_rate = TokenBucket(OPENAI_RPS, OPENAI_BURST)
+chat_slots = PriorityGate("chat", OPENAI_CONCURRENCY, openai_rate)
+embed_slots = PriorityGate("embed", EMBED_CONCURRENCY, openai_rate)
+vector_slots = PriorityGate("vector", VECTOR_CONCURRENCY)
+
+
+def openai_client() -> AsyncOpenAI:
+    global _openai
+    if _openai is None:
+        _openai = AsyncOpenAI(
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_SIZE,
+                    max_keepalive_connections=HTTP_POOL_SIZE,
+                ),
+            ),
+        )
+    return _openai
+
+
+def http_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=60),
+        )
+    return _session
+
+
+async def aclose():
+    global _openai, _session
+    if _openai is not None:
+        try:
+            await _openai.close()
+        except Exception as e:
+            logger.error(f"OpenAI client close error: {e}", exc_info=True)
+        _openai = None
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
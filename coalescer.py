@@ -0,0 +1,140 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from rate_limit import KeyedLimiter
+
+logger = logging.getLogger(__name__)
+
+COALESCE_WINDOW_SEC = float(os.getenv("COALESCE_WINDOW_SEC", "0.5"))
+COALESCE_MAX_WAIT_SEC = float(os.getenv("COALESCE_MAX_WAIT_SEC", "3.0"))
+
+
+class Turn:
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        self.messages: List[Any] = []
+        self.persisted = 0
+        self.committed = False
+        self.urgent = False
+        self.after: Optional[asyncio.Task] = None
+
+    @property
+    def message(self):
+        return self.messages[-1]
+
+    @property
+    def texts(self) -> List[str]:
+        return [m.text or "" for m in self.messages]
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+    def unpersisted(self) -> List[str]:
+        fresh = self.texts[self.persisted:]
+        self.persisted = len(self.messages)
+        return fresh
+
+
+class _ChatSlot:
+    def __init__(self):
+        self.pending: Optional[Turn] = None
+        self.first_at = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.bot = None
+        self.inflight: Optional[Turn] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+RunTurn = Callable[[Turn, Any], Awaitable[None]]
+
+
+class ChatCoalescer:
+    def __init__(
+        self,
+        run_turn: RunTurn,
+        window: float = COALESCE_WINDOW_SEC,
+        max_wait: float = COALESCE_MAX_WAIT_SEC,
+        user_limiter: Optional[KeyedLimiter] = None,
+    ):
+        self._run_turn = run_turn
+        self.window = max(0.0, window)
+        self.max_wait = max(self.window, max_wait)
+        self.user_limiter = user_limiter
+        self._slots: Dict[int, _ChatSlot] = {}
+        self.merged = 0
+        self.superseded = 0
+
+    def active_chats(self) -> int:
+        return len(self._slots)
+
+    def busy(self, chat_id: int) -> bool:
+        return chat_id in self._slots
+
+    def submit(self, message, bot, urgent: bool = False):
+        loop = asyncio.get_running_loop()
+        chat_id = message.chat.id
+        slot = self._slots.setdefault(chat_id, _ChatSlot())
+
+        if slot.pending is None:
+            slot.pending = Turn(chat_id)
+            slot.first_at = loop.time()
+            if slot.inflight is not None and not slot.inflight.committed and not slot.task.done():
+                slot.task.cancel()
+                slot.pending.messages = list(slot.inflight.messages)
+                slot.pending.persisted = slot.inflight.persisted
+                slot.pending.after = slot.inflight.after
+                self.superseded += 1
+        else:
+            self.merged += 1
+        slot.pending.messages.append(message)
+        slot.pending.urgent = slot.pending.urgent or urgent
+        slot.bot = bot
+
+        if slot.timer is not None:
+            slot.timer.cancel()
+        delay = 0.0 if slot.pending.urgent else min(self.window, max(0.0, slot.first_at + self.max_wait - loop.time()))
+        slot.timer = loop.call_later(delay, self._fire, chat_id, bot)
+
+    async def drain(self):
+        while self._slots:
+            for chat_id, slot in list(self._slots.items()):
+                if slot.pending is not None:
+                    if slot.timer is not None:
+                        slot.timer.cancel()
+                    self._fire(chat_id, slot.bot)
+            tasks = [slot.task for slot in self._slots.values() if slot.task is not None]
+            if not tasks:
+                break
+            await asyncio.wait(tasks)
+
+    def _fire(self, chat_id: int, bot):
+        slot = self._slots.get(chat_id)
+        if slot is None or slot.pending is None:
+            return
+        turn, slot.pending, slot.timer = slot.pending, None, None
+        if turn.after is None:
+            turn.after = slot.task
+        slot.inflight = turn
+        slot.task = asyncio.create_task(self._run(chat_id, slot, turn, bot))
+
+    async def _run(self, chat_id: int, slot: _ChatSlot, turn: Turn, bot):
+        try:
+            if turn.after is not None and not turn.after.done():
+                await asyncio.wait([turn.after])
+            if self.user_limiter is not None and not turn.urgent:
+                await self.user_limiter.acquire(turn.message.from_user.id)
+            await self._run_turn(turn, bot)
+        except asyncio.CancelledError:
+            if turn.committed:
+                raise
+        except Exception as e:
+            logger.error(f"Turn error: {e}", exc_info=True)
+        finally:
+            if slot.inflight is turn:
+                slot.inflight = None
+                slot.task = None
+            if slot.pending is None and slot.inflight is None and self._slots.get(chat_id) is slot:
+                del self._slots[chat_id]
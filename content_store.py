@@ -0,0 +1,62 @@
+import os
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+CONTENT_STORE = os.getenv("CONTENT_STORE", "0") == "1"
+CONTENT_DB = os.getenv("CONTENT_DB", os.path.join(DATA_DIR, "content.sqlite"))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS content ("
+    " id TEXT PRIMARY KEY,"
+    " chat_id TEXT NOT NULL,"
+    " text TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS content_chat ON content (chat_id)",
+)
+
+
+class ContentStore:
+    def __init__(self, db_path: Optional[str] = CONTENT_DB):
+        self._lock = threading.Lock()
+        if db_path != ":memory:" and not (db_path and os.path.isdir(os.path.dirname(db_path) or ".")):
+            raise RuntimeError(
+                f"CONTENT_STORE=1 needs a writable CONTENT_DB on disk; directory of {db_path!r} does not exist "
+                f"(set DATA_DIR or CONTENT_DB)"
+            )
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        for stmt in _SCHEMA:
+            self._db.execute(stmt)
+
+    def put_many(self, rows: Iterable[Tuple[str, str, str]]):
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO content (id, chat_id, text) VALUES (?, ?, ?)", rows)
+
+    def get_many(self, ids: List[str]) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                out.update(self._db.execute(
+                    f"SELECT id, text FROM content WHERE id IN ({','.join('?' * len(chunk))})", chunk,
+                ).fetchall())
+        return out
+
+    def delete_many(self, ids: List[str]):
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                self._db.execute(f"DELETE FROM content WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def clear(self, chat_id: str) -> int:
+        with self._lock:
+            return self._db.execute("DELETE FROM content WHERE chat_id = ?", (str(chat_id),)).rowcount
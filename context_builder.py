@@ -0,0 +1,115 @@
+import os
+import re
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1800"))
+DEDUPE_SIMILARITY = float(os.getenv("DEDUPE_SIMILARITY", "0.85"))
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", os.getenv("OPENAI_MODEL", "gpt-4.1-mini"))
+
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.error(f"tiktoken unavailable, using the byte heuristic: {e}")
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def message_tokens(msg: Dict[str, Any]) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(msg.get("content") or "")
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens]).rstrip() + " …"
+    cut = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", errors="ignore")
+    return cut.rsplit(" ", 1)[0].rstrip() + " …"
+
+
+def _shingles(text: str) -> frozenset:
+    return frozenset(w.lower() for w in _WORD.findall(text))
+
+
+def dedupe(items: List[Dict[str, Any]], threshold: float = DEDUPE_SIMILARITY) -> List[Dict[str, Any]]:
+    kept: List[Dict[str, Any]] = []
+    seen: List[frozenset] = []
+    for item in items:
+        words = _shingles(item.get("content") or "")
+        duplicate = False
+        for other in seen:
+            union = len(words | other)
+            if not union or len(words & other) / union >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(item)
+            seen.append(words)
+    return kept
+
+
+def build_messages(
+    system_prompt: str,
+    style_hint: str,
+    user_msg: str,
+    memories: List[Dict[str, Any]],
+    summary: Optional[Dict[str, Any]] = None,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> List[Dict[str, str]]:
+    head = [{"role": "system", "content": system_prompt}, {"role": "system", "content": style_hint}]
+    left = budget - REPLY_PRIMING_TOKENS - sum(message_tokens(m) for m in head)
+    user_text = truncate_to_tokens(user_msg, max(1, left - MESSAGE_OVERHEAD_TOKENS))
+    tail = {"role": "user", "content": user_text}
+    left -= message_tokens(tail)
+
+    msgs = list(head)
+    covered_upto = 0.0
+    if summary and summary.get("text"):
+        note = {"role": "system", "content": f"Summary of the earlier conversation:\n{summary['text']}"}
+        cost = message_tokens(note)
+        if cost <= left:
+            msgs.append(note)
+            left -= cost
+            covered_upto = float(summary.get("upto_ts") or 0.0)
+
+    ranked = dedupe([m for m in memories if m.get("content") and m.get("content") != user_msg])
+    if covered_upto:
+        ranked = [m for m in ranked if m.get("ts", 0.0) > covered_upto] + \
+                 [m for m in ranked if m.get("ts", 0.0) <= covered_upto]
+    chosen = []
+    for m in ranked:
+        item = {"role": m.get("role", "user"), "content": m["content"]}
+        cost = message_tokens(item)
+        if cost > left:
+            continue
+        chosen.append((m.get("ts", 0.0), item))
+        left -= cost
+    chosen.sort(key=lambda x: x[0])
+    msgs.extend(item for _, item in chosen)
+    msgs.append(tail)
+    return msgs
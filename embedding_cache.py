@@ -0,0 +1,170 @@
+import os
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+EMBED_CACHE_DB = os.getenv("EMBED_CACHE_DB", os.path.join(DATA_DIR, "embeddings.sqlite"))
+EMBED_CACHE_DB_ROWS = int(os.getenv("EMBED_CACHE_DB_ROWS", "100000"))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS embeddings ("
+    " key TEXT NOT NULL,"
+    " chat_id TEXT NOT NULL DEFAULT '',"
+    " vec BLOB NOT NULL,"
+    " PRIMARY KEY (key, chat_id))",
+    "CREATE INDEX IF NOT EXISTS embeddings_chat ON embeddings (chat_id)",
+)
+
+
+def cache_key(model: str, payload: str) -> str:
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\x00")
+    h.update(payload.encode("utf-8"))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_items: int = EMBED_CACHE_SIZE, db_path: Optional[str] = None, max_rows: int = EMBED_CACHE_DB_ROWS):
+        self.max_items = max(0, max_items)
+        self.max_rows = max(0, max_rows)
+        self._mem: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes: List[Tuple[str, str, bytes]] = []
+        self._writer: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str):
+        if not os.path.isdir(os.path.dirname(db_path) or "."):
+            return
+        try:
+            db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            for stmt in _SCHEMA:
+                db.execute(stmt)
+            self._db = db
+        except Exception as e:
+            logger.error(f"Embedding cache disk store error: {e}", exc_info=True)
+            self._db = None
+
+    def _remember(self, key: str, vec: List[float]):
+        if self.max_items == 0:
+            return
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        missing = []
+        for key in keys:
+            vec = self._mem.get(key)
+            if vec is not None:
+                self._mem.move_to_end(key)
+                found[key] = vec
+            else:
+                missing.append(key)
+        rows: Dict[str, bytes] = {}
+        if missing and self._db is not None:
+            try:
+                rows = await asyncio.to_thread(self._read, missing)
+            except Exception as e:
+                logger.error(f"Embedding cache read error: {e}", exc_info=True)
+            for key, blob in rows.items():
+                found[key] = array("f", blob).tolist()
+                self._remember(key, found[key])
+        self.hits += len(found)
+        self.disk_hits += len(rows)
+        self.misses += len(missing) - len(rows)
+        return found
+
+    async def get(self, key: str) -> Optional[List[float]]:
+        return (await self.get_many([key])).get(key)
+
+    def put(self, key: str, vec: List[float], chat_id: Optional[str] = None):
+        self._remember(key, vec)
+        if self._db is None:
+            return
+        self._writes.append((key, str(chat_id or ""), array("f", vec).tobytes()))
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._drain(), name="embedding-cache-writer")
+
+    async def purge(self, chat_id: str) -> int:
+        chat_id = str(chat_id)
+        self._writes = [w for w in self._writes if w[1] != chat_id]
+        if self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+        if self._db is None:
+            return 0
+        keys = await asyncio.to_thread(self._delete_chat, chat_id)
+        for key in keys:
+            self._mem.pop(key, None)
+        return len(keys)
+
+    async def flush(self):
+        if self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+
+    async def _drain(self):
+        while self._writes:
+            rows, self._writes = self._writes, []
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception as e:
+                logger.error(f"Embedding cache write error: {e}", exc_info=True)
+
+    def _read(self, keys: List[str]) -> Dict[str, bytes]:
+        out: Dict[str, bytes] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                out.update(self._db.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk,
+                ).fetchall())
+        return out
+
+    def _write(self, rows: List[Tuple[str, str, bytes]]):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, chat_id, vec) VALUES (?, ?, ?)", rows)
+                if self.max_rows > 0:
+                    self._db.execute(
+                        "DELETE FROM embeddings WHERE rowid <= (SELECT MAX(rowid) FROM embeddings) - ?", (self.max_rows,),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _delete_chat(self, chat_id: str) -> List[str]:
+        with self._lock:
+            keys = [k for (k,) in self._db.execute("SELECT key FROM embeddings WHERE chat_id = ?", (chat_id,))]
+            self._db.execute("DELETE FROM embeddings WHERE chat_id = ?", (chat_id,))
+        return keys
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self._mem),
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import clients
+from memory_pinecone import (
+    BOT_ID, UPSERT_BATCH, NAMESPACE_LAYOUT, NAMESPACE_LAYOUTS, get_store, chat_scope,
+    stash_texts, load_texts, forget_texts,
+)
+from vector_store import LocalStore
+from context_builder import truncate_to_tokens
+from scheduler import BACKGROUND, set_lane
+from sharding import shard_for
+
+logger = logging.getLogger(__name__)
+
+MEMORY_RETENTION_DAYS = float(os.getenv("MEMORY_RETENTION_DAYS", "0"))
+COMPACT_AFTER_DAYS = float(os.getenv("COMPACT_AFTER_DAYS", "0"))
+COMPACT_GROUP_SIZE = int(os.getenv("COMPACT_GROUP_SIZE", "8"))
+COMPACT_MAX_TOKENS = int(os.getenv("COMPACT_MAX_TOKENS", "300"))
+MAX_VECTORS_PER_CHAT = int(os.getenv("MAX_VECTORS_PER_CHAT", "0"))
+MAINTENANCE_PAGE_SIZE = int(os.getenv("MAINTENANCE_PAGE_SIZE", "100"))
+MAINTENANCE_INTERVAL_SEC = float(os.getenv("MAINTENANCE_INTERVAL_SEC", str(24 * 3600)))
+MAINTENANCE_IN_BOT = os.getenv("MAINTENANCE_IN_BOT", "0") == "1"
+
+DAY = 24 * 3600
+
+Row = Tuple[str, Any, Dict[str, Any]]
+
+
+def _ts(meta: Dict[str, Any]) -> float:
+    try:
+        return float(meta.get("timestamp"))
+    except Exception:
+        return 0.0
+
+
+async def iter_namespace(
+    namespace: str,
+    prefix: str = "",
+    chat_id: Optional[str] = None,
+    page_size: int = MAINTENANCE_PAGE_SIZE,
+) -> AsyncIterator[List[Row]]:
+    store = get_store()
+    token = None
+    while True:
+        ids, token = await store.list_ids(prefix, page_size, token, namespace=namespace)
+        if ids:
+            fetched = await store.fetch(ids, namespace=namespace)
+            page = [
+                (vid, v["values"], v["metadata"]) for vid, v in fetched.items()
+                if v["metadata"].get("bot_id") == BOT_ID
+                and (chat_id is None or str(v["metadata"].get("chat_id")) == str(chat_id))
+            ]
+            texts = await load_texts([vid for vid, _, meta in page if not meta.get("text")])
+            for vid, _, meta in page:
+                if vid in texts:
+                    meta["text"] = texts[vid]
+            if page:
+                yield page
+        if not token:
+            break
+
+
+async def discover_chats(layout: Optional[str] = None, page_size: int = MAINTENANCE_PAGE_SIZE) -> List[str]:
+    layout = layout or NAMESPACE_LAYOUT
+    if layout == "chat":
+        prefix = f"{BOT_ID}:"
+        return [ns[len(prefix):] for ns in await get_store().list_namespaces() if ns.startswith(prefix)]
+    chats = set()
+    async for page in iter_namespace(chat_scope("", layout)[0], page_size=page_size):
+        chats.update(str(meta.get("chat_id")) for _, _, meta in page)
+    return sorted(chats)
+
+
+async def iter_chat(
+    chat_id: str, page_size: int = MAINTENANCE_PAGE_SIZE, layout: Optional[str] = None,
+) -> AsyncIterator[List[Row]]:
+    async for page in iter_namespace(chat_scope(chat_id, layout)[0], f"{chat_id}-", chat_id, page_size):
+        yield page
+
+
+def _compact_group(chat_id: str, rows: List[Row]) -> Row:
+    lines = [f"{meta.get('role')}: {meta.get('text')}" for _, _, meta in rows]
+    text = truncate_to_tokens("Earlier in this conversation:\n" + "\n".join(lines), COMPACT_MAX_TOKENS)
+    centroid = np.mean(np.asarray([values for _, values, _ in rows], dtype=np.float32), axis=0)
+    norm = float(np.linalg.norm(centroid))
+    if norm > 0:
+        centroid /= norm
+    first, last = rows[0][2], rows[-1][2]
+    meta = {
+        "bot_id": BOT_ID,
+        "chat_id": str(chat_id),
+        "user_id": str(first.get("user_id", "")),
+        "role": "summary",
+        "text": text,
+        "timestamp": str(_ts(last)),
+        "from_ts": str(_ts(first)),
+        "count": len(rows),
+    }
+    vid = f"{chat_id}-{int(_ts(last) * 1000)}-c{uuid.uuid4().hex[:7]}"
+    return vid, centroid.tolist(), meta
+
+
+async def maintain_chat(
+    chat_id: str,
+    retention_days: float = MEMORY_RETENTION_DAYS,
+    compact_after_days: float = COMPACT_AFTER_DAYS,
+    group_size: int = COMPACT_GROUP_SIZE,
+    cap: int = MAX_VECTORS_PER_CHAT,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    now = time.time()
+    expire_before = now - retention_days * DAY if retention_days > 0 else None
+    compact_before = now - compact_after_days * DAY if compact_after_days > 0 else None
+
+    alive: List[Tuple[float, str]] = []
+    expired: List[str] = []
+    candidates: List[Row] = []
+    async for page in iter_chat(chat_id):
+        for vid, values, meta in page:
+            ts = _ts(meta)
+            if expire_before is not None and ts < expire_before:
+                expired.append(vid)
+                continue
+            if compact_before is not None and ts < compact_before and meta.get("role") in ("user", "assistant"):
+                candidates.append((vid, values, meta))
+            else:
+                alive.append((ts, vid))
+
+    candidates.sort(key=lambda r: _ts(r[2]))
+    full = len(candidates) - len(candidates) % group_size if group_size > 1 else 0
+    summaries = [_compact_group(chat_id, candidates[i:i + group_size]) for i in range(0, full, group_size)]
+    compacted = [vid for vid, _, _ in candidates[:full]]
+    alive.extend((_ts(meta), vid) for vid, _, meta in candidates[full:])
+    alive.extend((_ts(meta), vid) for vid, _, meta in summaries)
+
+    capped: List[str] = []
+    if cap > 0 and len(alive) > cap:
+        alive.sort(reverse=True)
+        capped = [vid for _, vid in alive[cap:]]
+    dropped = set(capped)
+    fresh = {vid for vid, _, _ in summaries}
+    summaries = [row for row in summaries if row[0] not in dropped]
+
+    stats = {"expired": len(expired), "compacted": len(compacted), "summaries": len(summaries), "capped": len(capped)}
+    if dry_run:
+        return stats
+
+    store = get_store()
+    namespace = chat_scope(chat_id)[0]
+    summaries = await stash_texts(summaries)
+    for i in range(0, len(summaries), UPSERT_BATCH):
+        await store.upsert(summaries[i:i + UPSERT_BATCH], namespace=namespace)
+    doomed = expired + compacted + [vid for vid in capped if vid not in fresh]
+    if doomed:
+        await store.delete_ids(doomed, namespace=namespace)
+        await forget_texts(doomed)
+    return stats
+
+
+async def maintain_all(
+    chats: Optional[List[str]] = None,
+    shard: int = 0,
+    shards: int = 1,
+    retention_days: float = MEMORY_RETENTION_DAYS,
+    compact_after_days: float = COMPACT_AFTER_DAYS,
+    group_size: int = COMPACT_GROUP_SIZE,
+    cap: int = MAX_VECTORS_PER_CHAT,
+    dry_run: bool = False,
+) -> Tuple[int, Dict[str, int]]:
+    chats = chats or await discover_chats()
+    if shards > 1:
+        chats = [c for c in chats if shard_for(int(c), shards) == shard]
+    totals: Dict[str, int] = {}
+    for chat_id in chats:
+        stats = await maintain_chat(chat_id, retention_days, compact_after_days, group_size, cap, dry_run)
+        if any(stats.values()):
+            logger.info(f"Maintenance chat={chat_id} {stats}")
+        for k, v in stats.items():
+            totals[k] = totals.get(k, 0) + v
+    return len(chats), totals
+
+
+async def maintenance_loop(interval: float = MAINTENANCE_INTERVAL_SEC, shard: int = 0, shards: int = 1):
+    set_lane(BACKGROUND)
+    while True:
+        try:
+            n, totals = await maintain_all(shard=shard, shards=shards)
+            logger.info(f"Maintenance done chats={n} {totals}")
+        except Exception as e:
+            logger.error(f"Maintenance error: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+async def export_chat(chat_id: str, out_dir: str, page_size: int = MAINTENANCE_PAGE_SIZE) -> int:
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, str(chat_id))
+    blocks: List[np.ndarray] = []
+    count = 0
+    with open(base + ".jsonl.tmp", "w", encoding="utf-8") as f:
+        async for page in iter_chat(chat_id, page_size):
+            f.writelines(json.dumps({"id": vid, "metadata": meta}, ensure_ascii=False) + "\n" for vid, _, meta in page)
+            blocks.append(np.asarray([values for _, values, _ in page], dtype=np.float32))
+            count += len(page)
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+    with open(base + ".npy.tmp", "wb") as f:
+        np.save(f, matrix)
+    os.replace(base + ".npy.tmp", base + ".npy")
+    os.replace(base + ".jsonl.tmp", base + ".jsonl")
+    return count
+
+
+async def _upsert_rows(rows: List[Row], layout: Optional[str] = None) -> None:
+    grouped: Dict[str, List[Row]] = {}
+    for row in rows:
+        grouped.setdefault(chat_scope(str(row[2].get("chat_id")), layout)[0], []).append(row)
+    grouped = {namespace: await stash_texts(batch) for namespace, batch in grouped.items()}
+    store = get_store()
+    for namespace, batch in grouped.items():
+        for i in range(0, len(batch), UPSERT_BATCH):
+            await store.upsert(batch[i:i + UPSERT_BATCH], namespace=namespace)
+
+
+async def import_chat(base: str) -> int:
+    base = base[:-len(".jsonl")] if base.endswith(".jsonl") else base
+    matrix = np.load(base + ".npy", mmap_mode="r")
+    count, batch = 0, []
+    with open(base + ".jsonl", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            row = json.loads(line)
+            batch.append((row["id"], np.asarray(matrix[i]).tolist(), row["metadata"]))
+            if len(batch) >= UPSERT_BATCH:
+                await _upsert_rows(batch)
+                count += len(batch)
+                batch = []
+    if batch:
+        await _upsert_rows(batch)
+        count += len(batch)
+    return count
+
+
+async def migrate(
+    source: str,
+    target: str = NAMESPACE_LAYOUT,
+    chats: Optional[List[str]] = None,
+    page_size: int = MAINTENANCE_PAGE_SIZE,
+    keep_source: bool = False,
+) -> int:
+    if source == target:
+        raise ValueError(f"Source and target layouts are both {source!r}")
+    if source == "chat" and not chats:
+        chats = await discover_chats(source, page_size)
+
+    if chats:
+        streams = [(chat_scope(c, source)[0], iter_chat(c, page_size, source)) for c in chats]
+    else:
+        namespace = chat_scope("", source)[0]
+        streams = [(namespace, iter_namespace(namespace, page_size=page_size))]
+
+    store = get_store()
+    moved = 0
+    for namespace, pages in streams:
+        done: List[str] = []
+        async for page in pages:
+            await _upsert_rows(page, target)
+            done.extend(vid for vid, _, _ in page)
+            moved += len(page)
+            logger.info(f"Migrated {moved} vectors ({source} -> {target})")
+        if done and not keep_source:
+            await store.delete_ids(done, namespace=namespace)
+    return moved
+
+
+async def run(args) -> None:
+    set_lane(BACKGROUND)
+    try:
+        store = get_store()
+        if isinstance(store, LocalStore) and args.command != "export" and not getattr(args, "dry_run", False):
+            store.lock_exclusive()
+        await store.warm()
+        if args.command == "export":
+            for chat_id in args.chat or await discover_chats():
+                n = await export_chat(chat_id, args.out)
+                logger.info(f"Exported chat={chat_id} vectors={n} -> {args.out}")
+        elif args.command == "import":
+            for path in args.paths:
+                n = await import_chat(path)
+                logger.info(f"Imported {path} vectors={n}")
+        elif args.command == "migrate":
+            n = await migrate(args.source, args.target, args.chat, args.page_size, args.keep_source)
+            logger.info(f"Migration done vectors={n} ({args.source} -> {args.target})")
+        else:
+            while True:
+                n, totals = await maintain_all(
+                    args.chat, retention_days=args.retention_days, compact_after_days=args.compact_after_days,
+                    group_size=args.group, cap=args.cap, dry_run=args.dry_run,
+                )
+                logger.info(f"Maintenance done chats={n} {totals}{' (dry run)' if args.dry_run else ''}")
+                if not args.every:
+                    break
+                await asyncio.sleep(args.every)
+    finally:
+        await clients.aclose()
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Vector memory maintenance: expiry, compaction, caps, export/import, layout migration.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    mt = sub.add_parser("run", help="expire, compact and cap chat memories")
+    mt.add_argument("--chat", action="append", help="chat id (repeatable); default: every chat found in the vector store")
+    mt.add_argument("--retention-days", type=float, default=MEMORY_RETENTION_DAYS, help="0 = keep forever")
+    mt.add_argument("--compact-after-days", type=float, default=COMPACT_AFTER_DAYS, help="0 = no compaction")
+    mt.add_argument("--group", type=int, default=COMPACT_GROUP_SIZE, help="turns merged into one summary vector")
+    mt.add_argument("--cap", type=int, default=MAX_VECTORS_PER_CHAT, help="max vectors per chat (0 = unlimited)")
+    mt.add_argument("--dry-run", action="store_true")
+    mt.add_argument("--every", type=float, default=0.0, help=f"repeat every N seconds (e.g. {MAINTENANCE_INTERVAL_SEC:.0f})")
+
+    ex = sub.add_parser("export", help="dump chat memories to <out>/<chat>.jsonl + .npy")
+    ex.add_argument("--chat", action="append")
+    ex.add_argument("--out", required=True)
+
+    im = sub.add_parser("import", help="load <base>.jsonl + <base>.npy dumps back into the store")
+    im.add_argument("paths", nargs="+")
+
+    mg = sub.add_parser("migrate", help="stream vectors from one namespace layout into another")
+    mg.add_argument("--from", dest="source", choices=NAMESPACE_LAYOUTS, default="shared")
+    mg.add_argument("--to", dest="target", choices=NAMESPACE_LAYOUTS, default=NAMESPACE_LAYOUT)
+    mg.add_argument("--chat", action="append", help="chat id (repeatable); default: the whole source namespace")
+    mg.add_argument("--page-size", type=int, default=MAINTENANCE_PAGE_SIZE)
+    mg.add_argument("--keep-source", action="store_true", help="copy instead of move")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(format="%(asctime)s | %(levelname)s | %(name)s | %(message)s", level=logging.INFO)
+    asyncio.run(run(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
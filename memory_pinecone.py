@@ -1,11 +1,21 @@
 import os
 import time
 import uuid
+import asyncio
 import logging
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
 
-from openai import OpenAI
-from pinecone import Pinecone, ServerlessSpec
+import numpy as np
+
+from clients import openai_client, embed_slots
+from embedding_cache import EmbeddingCache, cache_key, EMBED_CACHE_SIZE, EMBED_CACHE_DB
+from recency_index import RecencyIndex
+from content_store import ContentStore, CONTENT_STORE
+from vector_store import VectorStore, PineconeStore, LocalStore, DimensionMismatch
+from metrics import counter, gauge
+from resilience import call, BreakerOpen
+from rerank import blend_scores, mmr_select, MMR_LAMBDA
+from context_builder import count_tokens, truncate_to_tokens, CONTEXT_TOKEN_BUDGET
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +23,12 @@ BOT_ID = os.getenv("BOT_ID", "psychologist")
 
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")  
 EMBED_TRUNCATE_CHARS = int(os.getenv("EMBED_TRUNCATE_CHARS", "4000"))
-DIMENSION = int(os.getenv("DIMENSION", "1536"))
+EMBED_DIMENSIONS = int(os.getenv("EMBED_DIMENSIONS", "0"))
+DIMENSION = int(os.getenv("DIMENSION", str(EMBED_DIMENSIONS or 1536)))
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+NAMESPACE_LAYOUT = os.getenv("NAMESPACE_LAYOUT", "shared").lower()
+NAMESPACE_LAYOUTS = ("shared", "bot", "chat")
 
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_CLOUD = os.getenv("PINECONE_CLOUD", "aws")
@@ -22,33 +37,149 @@ PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "psychologist-memory")
 
 RECENT_TAU_SEC = int(os.getenv("RECENT_TAU_SEC", str(6 * 3600)))  
 RECENCY_BIAS = float(os.getenv("RECENCY_BIAS", "0.35"))           
+UPSERT_BATCH = int(os.getenv("UPSERT_BATCH", "100"))
+RERANK_RAW_K = int(os.getenv("RERANK_RAW_K", "24"))
+
+_oa = None
+_store: Optional[VectorStore] = None
+_emb_cache = EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_DB)
+_recent = RecencyIndex()
+_content = ContentStore() if CONTENT_STORE else None
+_embed_model_key = f"{EMBEDDING_MODEL}:{EMBED_DIMENSIONS}" if EMBED_DIMENSIONS else EMBEDDING_MODEL
+_embed_options = {"dimensions": EMBED_DIMENSIONS} if EMBED_DIMENSIONS else {}
+
+EMBED_REQUESTS = counter("bot_embedding_requests_total", "Embedding API requests.")
+EMBEDDED_TEXTS = counter("bot_embedded_texts_total", "Texts sent to the embedding API.")
+VECTOR_REQUESTS = counter("bot_vector_requests_total", "Vector store requests by operation.")
+UPSERTED_VECTORS = counter("bot_upserted_vectors_total", "Vectors written to the vector store.")
+_cache_gauge = gauge("bot_embedding_cache", "Embedding cache statistics.")
+for _stat in ("hits", "disk_hits", "misses", "size", "hit_rate"):
+    _cache_gauge.set_function(lambda s=_stat: _emb_cache.stats()[s], stat=_stat)
+
+def _make_store() -> VectorStore:
+    if NAMESPACE_LAYOUT not in NAMESPACE_LAYOUTS:
+        raise RuntimeError(f"Unknown NAMESPACE_LAYOUT: {NAMESPACE_LAYOUT}")
+    if EMBED_DIMENSIONS and EMBED_DIMENSIONS != DIMENSION:
+        raise RuntimeError(f"EMBED_DIMENSIONS={EMBED_DIMENSIONS} does not match DIMENSION={DIMENSION}")
+    if VECTOR_BACKEND == "local":
+        return LocalStore(DIMENSION)
+    if VECTOR_BACKEND != "pinecone":
+        raise RuntimeError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+    return PineconeStore(PINECONE_API_KEY, PINECONE_INDEX_NAME, DIMENSION, PINECONE_CLOUD, PINECONE_REGION)
 
-_oa = OpenAI()  
+def chat_scope(chat_id: str, layout: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    layout = layout or NAMESPACE_LAYOUT
+    if layout == "chat":
+        return f"{BOT_ID}:{chat_id}", {}
+    if layout == "bot":
+        return BOT_ID, {"chat_id": str(chat_id)}
+    return "", {"bot_id": BOT_ID, "chat_id": str(chat_id)}
 
-_pc = Pinecone(api_key=PINECONE_API_KEY)
-_existing = [i.name for i in _pc.list_indexes()]
-if PINECONE_INDEX_NAME not in _existing:
-    _pc.create_index(
-        name=PINECONE_INDEX_NAME,
-        dimension=DIMENSION,
-        metric="cosine",
-        spec=ServerlessSpec(cloud=PINECONE_CLOUD, region=PINECONE_REGION),
-    )
-_index = _pc.Index(PINECONE_INDEX_NAME)
+def _openai():
+    global _oa
+    if _oa is None:
+        _oa = openai_client()
+    return _oa
+
+def get_store() -> VectorStore:
+    global _store
+    if _store is None:
+        _store = _make_store()
+    return _store
+
+async def warm_up() -> bool:
+    t0 = time.perf_counter()
+    try:
+        await get_store().warm()
+    except DimensionMismatch:
+        raise
+    except Exception as e:
+        logger.error(f"Vector store warm-up error: {e}", exc_info=True)
+        return False
+    logger.info(f"Vector store ({VECTOR_BACKEND}) ready in {(time.perf_counter() - t0) * 1000:.0f}ms")
+    return True
 
 def _now() -> float:
     return time.time()
 
-def _embed_text(text: str):
+def _payload(text: str) -> str:
+    return text if len(text) <= EMBED_TRUNCATE_CHARS else (text[:EMBED_TRUNCATE_CHARS] + " …")
+
+async def _embed_text(text: str, chat_id: Optional[str] = None):
     if not isinstance(text, str) or not text.strip():
         return None
-    payload = text if len(text) <= EMBED_TRUNCATE_CHARS else (text[:EMBED_TRUNCATE_CHARS] + " …")
+    return (await _embed_texts([text], [chat_id]))[0]
+
+async def _embed_texts(texts: List[str], chats: Optional[List[Optional[str]]] = None) -> List[Optional[List[float]]]:
+    out: List[Optional[List[float]]] = [None] * len(texts)
+    pending: Dict[str, Tuple[str, List[int]]] = {}
+    for i, text in enumerate(texts):
+        if not isinstance(text, str) or not text.strip():
+            continue
+        payload = _payload(text)
+        key = cache_key(_embed_model_key, payload)
+        pending.setdefault(key, (payload, []))[1].append(i)
+    cached = await _emb_cache.get_many(list(pending))
+    for key, vec in cached.items():
+        for i in pending.pop(key)[1]:
+            out[i] = vec
+    if not pending:
+        return out
+
+    keys = list(pending.keys())
     try:
-        resp = _oa.embeddings.create(model=EMBEDDING_MODEL, input=[payload])
-        return resp.data[0].embedding
+        EMBED_REQUESTS.inc()
+        EMBEDDED_TEXTS.inc(len(keys))
+        inputs = [pending[k][0] for k in keys]
+        async with embed_slots:
+            resp = await call(
+                "embeddings", "embeddings",
+                lambda: _openai().embeddings.create(model=EMBEDDING_MODEL, input=inputs, **_embed_options),
+                hedge=True,
+            )
+    except BreakerOpen:
+        return out
     except Exception as e:
         logger.error(f"Embedding error: {e}", exc_info=True)
-        return None
+        return out
+    for d in resp.data:
+        key = keys[d.index]
+        owners = {chats[i] for i in pending[key][1]} if chats else {None}
+        for owner in owners:
+            _emb_cache.put(key, d.embedding, owner)
+        for i in pending[key][1]:
+            out[i] = d.embedding
+    return out
+
+async def embed_query(text: str, chat_id: Optional[str] = None) -> Optional[List[float]]:
+    return await _embed_text(text, chat_id)
+
+def embedding_cache_stats() -> Dict[str, float]:
+    return _emb_cache.stats()
+
+async def stash_texts(vectors: List[Tuple[str, Any, Dict[str, Any]]]) -> List[Tuple[str, Any, Dict[str, Any]]]:
+    if _content is None:
+        return vectors
+    rows = [(vid, str(meta.get("chat_id")), meta["text"]) for vid, _, meta in vectors if meta.get("text")]
+    await asyncio.to_thread(_content.put_many, rows)
+    return [(vid, values, {k: v for k, v in meta.items() if k != "text"}) for vid, values, meta in vectors]
+
+async def load_texts(ids: List[str]) -> Dict[str, str]:
+    if _content is None or not ids:
+        return {}
+    try:
+        return await asyncio.to_thread(_content.get_many, ids)
+    except Exception as e:
+        logger.error(f"Content store read error: {e}", exc_info=True)
+        return {}
+
+async def forget_texts(ids: List[str]):
+    if _content is None or not ids:
+        return
+    try:
+        await asyncio.to_thread(_content.delete_many, ids)
+    except Exception as e:
+        logger.error(f"Content store delete error: {e}", exc_info=True)
 
 def _as_ts(meta_ts: Any) -> float:
     try:
@@ -56,20 +187,15 @@ def _as_ts(meta_ts: Any) -> float:
     except Exception:
         return 0.0
 
-def _recency_weight(ts: float, now_ts: float) -> float:
-    if ts <= 0:
-        return 0.0
-    age = max(0.0, now_ts - ts)
-    return pow(2.718281828, -age / max(1.0, RECENT_TAU_SEC))
-
-def save_message(user_id: str, chat_id: str, message: str, role: str) -> bool:
+def new_record(
+    user_id: str,
+    chat_id: str,
+    message: str,
+    role: str,
+    emb: Optional[List[float]] = None,
+) -> Optional[Dict[str, Any]]:
     if not isinstance(message, str) or len(message.strip()) < 2:
-        return False
-
-    emb = _embed_text(message)
-    if emb is None:
-        return False
-
+        return None
     ts = str(_now())
     meta = {
         "bot_id": BOT_ID,
@@ -80,112 +206,203 @@ def save_message(user_id: str, chat_id: str, message: str, role: str) -> bool:
         "timestamp": ts,
     }
     vector_id = f"{chat_id}-{int(float(ts)*1000)}-{uuid.uuid4().hex[:8]}"
+    record = {"id": vector_id, "meta": meta}
+    if emb is not None:
+        record["values"] = emb
+    return record
+
+async def save_records(records: List[Dict[str, Any]]) -> bool:
+    if not records:
+        return True
+    try:
+        await asyncio.to_thread(_recent.add, records)
+    except Exception as e:
+        logger.error(f"Recency index write error: {e}", exc_info=True)
+
+    embs = [r.get("values") for r in records]
+    missing = [i for i, e in enumerate(embs) if e is None]
+    if missing:
+        fresh = await _embed_texts(
+            [records[i]["meta"]["text"] for i in missing],
+            [str(records[i]["meta"]["chat_id"]) for i in missing],
+        )
+        for i, e in zip(missing, fresh):
+            embs[i] = e
+    if any(e is None for e in embs):
+        return False
+
+    vectors = [(r["id"], e, r["meta"]) for r, e in zip(records, embs)]
+    try:
+        vectors = await stash_texts(vectors)
+    except Exception as e:
+        logger.error(f"Content store write error, keeping text inline: {e}", exc_info=True)
+    grouped: Dict[str, List[Tuple[str, List[float], Dict[str, Any]]]] = {}
+    for v in vectors:
+        grouped.setdefault(chat_scope(v[2]["chat_id"])[0], []).append(v)
     try:
-        _index.upsert(vectors=[(vector_id, emb, meta)])
+        for namespace, vectors in grouped.items():
+            for i in range(0, len(vectors), UPSERT_BATCH):
+                chunk = vectors[i:i + UPSERT_BATCH]
+                VECTOR_REQUESTS.inc(op="upsert")
+                await call("vector", "upsert", lambda: get_store().upsert(chunk, namespace=namespace))
+                UPSERTED_VECTORS.inc(len(chunk))
         return True
+    except BreakerOpen:
+        logger.error("Vector store upsert skipped: circuit open")
+        return False
     except Exception as e:
-        logger.error(f"Pinecone upsert error: {e}", exc_info=True)
+        logger.error(f"Vector store upsert error: {e}", exc_info=True)
+        return False
+
+async def save_message(user_id: str, chat_id: str, message: str, role: str) -> bool:
+    record = new_record(user_id, chat_id, message, role)
+    if record is None:
         return False
+    return await save_records([record])
 
-def get_relevant_history(
+async def get_relevant_history(
     chat_id: str,
     query: str,
     top_k: int = 8,
-    max_chars: int = 4000,
+    max_tokens: int = CONTEXT_TOKEN_BUDGET,
     min_score: float = 0.3,
-) -> List[Dict[str, Any]]:
-    emb = _embed_text(query if isinstance(query, str) else "")
+    emb: Optional[List[float]] = None,
+) -> Optional[List[Dict[str, Any]]]:
     if emb is None:
-        return []
+        emb = await _embed_text(query if isinstance(query, str) else "", chat_id)
+    if emb is None:
+        return None
 
     try:
-        raw_k = max(top_k * 3, 24)
-        res = _index.query(
+        raw_k = max(top_k * 3, RERANK_RAW_K)
+        diversify = MMR_LAMBDA < 1.0
+        namespace, filter = chat_scope(chat_id)
+        VECTOR_REQUESTS.inc(op="query")
+        res = await call("vector", "query", lambda: get_store().query(
             vector=emb,
-            filter={"bot_id": BOT_ID, "chat_id": str(chat_id)},
+            filter=filter,
             top_k=raw_k,
-            include_metadata=True,
-        )
+            include_values=diversify,
+            namespace=namespace,
+        ), hedge=True)
 
-        now_ts = _now()
-        scored: List[Tuple[float, float, Dict[str, Any]]] = []
-        for m in res.get("matches", []):
-            score = float(m.get("score") or 0.0)
-            if score < min_score:
-                continue
-            meta = (m.get("metadata") or {})
-            role = meta.get("role")
-            text = meta.get("text")
-            ts = _as_ts(meta.get("timestamp"))
-            if role in ("user", "assistant") and text:
-                rec = _recency_weight(ts, now_ts)
-                final = (1.0 - RECENCY_BIAS) * score + RECENCY_BIAS * rec
-                scored.append((final, ts, {"role": role, "content": text, "ts": ts}))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
-        chosen = scored[:top_k]
-        chosen.sort(key=lambda x: x[1])
+        matches = [
+            m for m in res.get("matches", [])
+            if (m.get("metadata") or {}).get("role") in ("user", "assistant", "summary")
+            and ((m.get("metadata") or {}).get("text") or _content is not None)
+        ]
+        if not matches:
+            return []
+        sims = np.fromiter((float(m.get("score") or 0.0) for m in matches), dtype=np.float64, count=len(matches))
+        keep = np.flatnonzero(sims >= min_score)
+        if not len(keep):
+            return []
+        matches = [matches[i] for i in keep]
+        ts = np.fromiter((_as_ts(m["metadata"].get("timestamp")) for m in matches), dtype=np.float64, count=len(matches))
+        final = blend_scores(sims[keep], ts, _now(), RECENCY_BIAS, RECENT_TAU_SEC)
+
+        vectors = None
+        if diversify:
+            values = [m.get("values") for m in matches]
+            if all(v is not None and len(v) == len(emb) for v in values):
+                vectors = values
 
+        chosen = mmr_select(final, vectors, top_k)
+        texts = await load_texts([matches[i]["id"] for i in chosen if not matches[i]["metadata"].get("text")])
         history, used = [], 0
-        for _, _, item in chosen:
-            c = item["content"]
-            if used + len(c) > max_chars:
+        for i in chosen:
+            meta = matches[i]["metadata"]
+            text = meta.get("text") or texts.get(matches[i]["id"])
+            if not text:
+                continue
+            role = "system" if meta["role"] == "summary" else meta["role"]
+            item = {"role": role, "content": text, "ts": float(ts[i]), "score": float(final[i])}
+            cost = count_tokens(item["content"])
+            if used + cost > max_tokens:
                 if used == 0:
-                    history.append({"role": item["role"], "content": c[:max_chars]})
-                break
-            history.append({"role": item["role"], "content": c})
-            used += len(c)
+                    history.append(dict(item, content=truncate_to_tokens(item["content"], max_tokens)))
+                    break
+                continue
+            history.append(item)
+            used += cost
         return history
+    except BreakerOpen:
+        return None
     except Exception as e:
-        logger.error(f"Pinecone relevant-history error: {e}", exc_info=True)
+        logger.error(f"Vector store relevant-history error: {e}", exc_info=True)
+        return None
+
+async def get_recent_history(chat_id: str, limit: int = 3) -> List[Dict[str, Any]]:
+    try:
+        return await asyncio.to_thread(_recent.latest, str(chat_id), limit)
+    except Exception as e:
+        logger.error(f"Recency index read error: {e}", exc_info=True)
         return []
 
-def get_recent_history(chat_id: str, limit: int = 3) -> List[Dict[str, Any]]:
+async def get_recent_user_messages(chat_id: str, limit: int = 3) -> List[Dict[str, Any]]:
     try:
-        res = _index.query(
-            vector=[0.0] * DIMENSION,  
-            filter={"bot_id": BOT_ID, "chat_id": str(chat_id)},
-            top_k=max(300, limit * 20),
-            include_metadata=True,
-        )
-        items: List[Tuple[float, Dict[str, Any]]] = []
-        for m in res.get("matches", []):
-            meta = (m.get("metadata") or {})
-            role, text = meta.get("role"), meta.get("text")
-            ts = _as_ts(meta.get("timestamp"))
-            if role in ("user", "assistant") and text:
-                items.append((ts, {"role": role, "content": text}))
-        items.sort(key=lambda x: x[0], reverse=True)
-        return [x[1] for x in items[:limit]]
-    except Exception as e:
-        logger.error(f"Pinecone recent-history error: {e}", exc_info=True)
+        return await asyncio.to_thread(_recent.latest, str(chat_id), limit, "user")
+    except Exception as e:
+        logger.error(f"Recency index read error: {e}", exc_info=True)
         return []
 
-def get_recent_user_messages(chat_id: str, limit: int = 3) -> List[Dict[str, Any]]:
+async def get_summary(chat_id: str) -> Optional[Dict[str, Any]]:
     try:
-        res = _index.query(
-            vector=[0.0] * DIMENSION,
-            filter={"bot_id": BOT_ID, "chat_id": str(chat_id), "role": "user"},
-            top_k=max(1000, limit * 50),
-            include_metadata=True,
-        )
-        items: List[Tuple[float, Dict[str, Any]]] = []
-        for m in res.get("matches", []):
-            meta = (m.get("metadata") or {})
-            text = meta.get("text")
-            ts = _as_ts(meta.get("timestamp"))
-            if text:
-                items.append((ts, {"role": "user", "content": text}))
-        items.sort(key=lambda x: x[0], reverse=True)
-        return [x[1] for x in items[:limit]]
-    except Exception as e:
-        logger.error(f"Pinecone recent-user error: {e}", exc_info=True)
+        return await asyncio.to_thread(_recent.get_summary, str(chat_id))
+    except Exception as e:
+        logger.error(f"Summary read error: {e}", exc_info=True)
+        return None
+
+async def set_summary(chat_id: str, text: str, upto_ts: float) -> bool:
+    try:
+        await asyncio.to_thread(_recent.set_summary, str(chat_id), text, upto_ts)
+        return True
+    except Exception as e:
+        logger.error(f"Summary write error: {e}", exc_info=True)
+        return False
+
+async def get_messages_since(chat_id: str, ts: float, limit: int = 50) -> List[Dict[str, Any]]:
+    try:
+        return await asyncio.to_thread(_recent.since, str(chat_id), ts, limit)
+    except Exception as e:
+        logger.error(f"Recency index read error: {e}", exc_info=True)
         return []
 
-def clear_memory(chat_id: str) -> bool:
+async def count_messages_since(chat_id: str, ts: float) -> int:
+    try:
+        return await asyncio.to_thread(_recent.count_since, str(chat_id), ts)
+    except Exception as e:
+        logger.error(f"Recency index read error: {e}", exc_info=True)
+        return 0
+
+async def clear_memory(chat_id: str, pending=None) -> bool:
+    if pending is not None:
+        try:
+            await pending.discard(str(chat_id))
+        except Exception as e:
+            logger.error(f"Write-behind discard error: {e}", exc_info=True)
+    try:
+        await asyncio.to_thread(_recent.clear, str(chat_id))
+    except Exception as e:
+        logger.error(f"Recency index clear error: {e}", exc_info=True)
+    try:
+        await _emb_cache.purge(str(chat_id))
+    except Exception as e:
+        logger.error(f"Embedding cache purge error: {e}", exc_info=True)
+    if _content is not None:
+        try:
+            await asyncio.to_thread(_content.clear, str(chat_id))
+        except Exception as e:
+            logger.error(f"Content store clear error: {e}", exc_info=True)
+    namespace, filter = chat_scope(chat_id)
     try:
-        _index.delete(filter={"bot_id": BOT_ID, "chat_id": str(chat_id)})
+        if NAMESPACE_LAYOUT == "chat":
+            VECTOR_REQUESTS.inc(op="drop_namespace")
+            await call("vector", "delete", lambda: get_store().drop_namespace(namespace))
+        else:
+            VECTOR_REQUESTS.inc(op="delete")
+            await call("vector", "delete", lambda: get_store().delete(filter=filter, namespace=namespace))
         return True
     except Exception as e:
-        logger.error(f"Pinecone clear error: {e}", exc_info=True)
+        logger.error(f"Vector store clear error: {e}", exc_info=True)
         return False
@@ -0,0 +1,289 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter as _Tally
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+PROFILE_INTERVAL_SEC = float(os.getenv("PROFILE_INTERVAL_SEC", "0.005"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+        self._fns: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        with self._lock:
+            self._fns[_key(labels)] = fn
+
+    def value(self, **labels) -> float:
+        key = _key(labels)
+        fn = self._fns.get(key)
+        return float(fn()) if fn is not None else self._values.get(key, 0.0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            fns = dict(self._fns)
+        for key, fn in fns.items():
+            try:
+                values[key] = float(fn())
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback error: {e}", exc_info=True)
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelKey, List[int]] = {}
+        self._sums: Dict[LabelKey, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+                self._sums[key] = 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        return sum(self._counts.get(_key(labels), []))
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                running = 0
+                for bound, c in zip(self.buckets, counts):
+                    running += c
+                    lines.append(f"{self.name}_bucket{_fmt_labels(key, ('le', _fmt_value(bound)))} {running}")
+                lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(self._sums[key])}")
+                lines.append(f"{self.name}_count{_fmt_labels(key)} {running}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+DEPENDENCY_SECONDS = histogram("bot_dependency_seconds", "Latency of outbound calls by dependency and operation.")
+DEPENDENCY_ERRORS = counter("bot_dependency_errors_total", "Failed outbound calls by dependency and operation.")
+
+
+@contextmanager
+def track(dep: str, op: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dep=dep, op=op)
+        raise
+    finally:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - t0, dep=dep, op=op)
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL_SEC):
+        self.interval = max(0.001, interval)
+        self._stacks: _Tally = _Tally()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.samples = 0
+        self.started_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: Optional[int] = None) -> bool:
+        if self.running:
+            return False
+        self._stacks.clear()
+        self.samples = 0
+        self._target = thread_id or threading.main_thread().ident
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> str:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(parts))] += 1
+            self.samples += 1
+
+
+profiler = SamplingProfiler()
+
+
+def make_metrics_app(registry: Registry = REGISTRY) -> web.Application:
+    async def metrics_handler(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def profile_start(request: web.Request) -> web.Response:
+        started = profiler.start()
+        return web.json_response({"started": started, "running": profiler.running})
+
+    async def profile_stop(request: web.Request) -> web.Response:
+        return web.Response(text=profiler.stop(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_post("/debug/profile/start", profile_start)
+    app.router.add_post("/debug/profile/stop", profile_stop)
+    return app
+
+
+async def serve_metrics(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[web.AppRunner]:
+    if port <= 0:
+        return None
+    runner = web.AppRunner(make_metrics_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics endpoint on :{port}/metrics")
+    return runner
@@ -1,16 +1,20 @@
 import os
 import re
+import time
+import signal
 import asyncio
 import logging
-from collections import deque, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import NamedTuple
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode, ChatAction
 from aiogram.client.default import DefaultBotProperties
 from aiogram.filters import CommandStart
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import (
     Message, CallbackQuery,
     InlineKeyboardMarkup, InlineKeyboardButton
@@ -22,8 +26,14 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "0") == "1"
+STREAM_EDIT_INTERVAL_SEC = max(1.0, float(os.getenv("STREAM_EDIT_INTERVAL_SEC", "1.0")))
+STREAM_PLACEHOLDER = "…"
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+ALLOWED_UPDATES = ["message", "callback_query"]
+USER_RATE_PER_MIN = float(os.getenv("USER_RATE_PER_MIN", "20"))
+USER_BURST = float(os.getenv("USER_BURST", "5"))
 
-oa = OpenAI()  
 logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
     level=logging.INFO,
@@ -121,6 +131,16 @@ STYLE_HINTS = {
 REPLY_MAX_SENTENCES = 4
 REPLY_MAX_WORDS = 90
 
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", MODEL_NAME)
+DEGRADED_MODEL = os.getenv("DEGRADED_MODEL", MODEL_NAME)
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "250"))
+SUMMARY_PROMPT = (
+    "You maintain a running summary of an emotional-support chat. Merge the current summary with the new messages. "
+    "Keep what matters for continuity: the person's situation, feelings, people and events they mentioned, "
+    "what helped and what did not. Third person, under 150 words, in the language of the conversation. "
+    "No advice, no interpretation beyond what was said."
+)
+
 _SENT_SPLIT = re.compile(r'(?<=[.!?])\s+')
 _FILLERS_START = [
     "понимаю", "мне жаль", "хочу заверить", "важно помнить",
@@ -128,33 +148,146 @@ _FILLERS_START = [
     "capisco", "mi dispiace", "vorrei rassicurarti", "è importante ricordare",
 ]
 _CYRILLIC_RE = re.compile(r'[\u0400-\u04FF]')
+_ITALIAN_RE = re.compile(r"\b(come|stai|sto|va|grazie|perch[eè]|quest[oa]|aiuto|cosa|penso|sent[io])\b")
+_SPACES_RE = re.compile(r'\s+')
 
 _SMALLTALK_PATTERNS = {
     "ru": r"(как\s+дела( у тебя)?|как\s+ты|как\s+настроение|что\s+делаешь|чем\s+занимаешься)",
     "en": r"(how\s+are\s+you|how'?s\s+it\s+going|what'?s\s+up)",
     "it": r"(come\s+stai|come\s+va|che\s+fai|che\s+si\s+dice)",
 }
+_SMALLTALK_RE = {lang: re.compile(patt) for lang, patt in _SMALLTALK_PATTERNS.items()}
+_SAFETY_PATTERN = (
+    r"(suicid|kill\s+myself|end\s+(my|it)\s+all|end\s+my\s+life|self[-\s]?harm|hurt(ing)?\s+myself|cut(ting)?\s+myself"
+    r"|want\s+to\s+die|don'?t\s+want\s+to\s+(live|be\s+here)|overdose|abus|violen|hits?\s+me|beats?\s+me"
+    r"|суицид|покончить\s+с\s+собой|убить\s+себя|не\s+хочу\s+жить|хочу\s+умереть|порезать\s+себ|насили|бь[её]т\s+меня"
+    r"|uccidermi|farla\s+finita|togliermi\s+la\s+vita|voglio\s+morire|farmi\s+del\s+male|violenz|mi\s+picchia)"
+)
+_SAFETY_LOWER_RE = re.compile(_SAFETY_PATTERN)
+
 _SMALLTALK_REPLY = {
     "ru": "Спасибо, что спрашиваешь! У меня всё ок — я полностью здесь ради тебя. Что сейчас больше всего занимает тебя?",
     "en": "Thanks for asking! I’m doing well and fully here for you. What’s most on your mind right now?",
     "it": "Grazie! Sto bene e sono qui per te. Cosa ti pesa di più in questo momento?",
 }
 
-USER_LANG = defaultdict(lambda: DEFAULT_LANG)       
-RECENT_CACHE = defaultdict(lambda: deque(maxlen=5)) 
-state_lock = asyncio.Lock()
+_BUSY_REPLY = {
+    "ru": "Я получил твоё сообщение, но сейчас очень много разговоров одновременно. Напиши мне ещё раз через минуту — я здесь.",
+    "en": "I got your message, but I’m handling a lot of conversations right now. Please write again in a minute — I’m here.",
+    "it": "Ho ricevuto il tuo messaggio, ma in questo momento sto seguendo molte conversazioni. Riscrivimi tra un minuto — sono qui.",
+}
 
 from memory_pinecone import ( 
-    save_message,
+    new_record,
+    save_records,
+    embed_query,
     get_relevant_history,
     get_recent_history,
     get_recent_user_messages,
+    warm_up,
     clear_memory,
+    VECTOR_BACKEND,
+)
+from write_behind import WriteBehindQueue
+import clients
+from clients import openai_client, chat_slots
+from coalescer import ChatCoalescer, Turn
+from rate_limit import KeyedLimiter
+from state_store import StateStore
+from metrics import counter, gauge, histogram, serve_metrics, METRICS_PORT
+from resilience import call, is_open, POLICIES
+from context_builder import build_messages
+from summarizer import RollingSummarizer
+from reply_cache import SemanticReplyCache, REPLY_CACHE
+from maintenance import maintenance_loop, MAINTENANCE_IN_BOT
+from scheduler import Admission, SAFETY, INTERACTIVE, DEGRADED, SHED
+from sharding import (
+    ChatOrderedRunner, ProcessShardRouter, consume_queue, make_webhook_app, serve, wait_for_signal,
+    SHARD_COUNT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET,
 )
 
-async def run_blocking(func, *args, **kwargs):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+oa = None
+
+state = StateStore(default_lang=DEFAULT_LANG)
+persist_queue = WriteBehindQueue(save_records, blocked=lambda: is_open("embeddings") or is_open("vector"))
+coalescer = ChatCoalescer(
+    lambda turn, bot: _run_turn(turn, bot),
+    user_limiter=KeyedLimiter(USER_RATE_PER_MIN / 60.0, USER_BURST),
+)
+
+TURNS = counter("bot_turns_total", "Completed turns by kind.")
+TURN_STAGE_SECONDS = histogram("bot_turn_stage_seconds", "Per-stage turn latency.")
+CHAT_TOKENS = counter("bot_chat_tokens_total", "Chat completion tokens by kind.")
+_queues = gauge("bot_queue_depth", "Depth of internal queues.")
+_queues.set_function(persist_queue.depth, queue="persist")
+_queues.set_function(coalescer.active_chats, queue="coalescer_chats")
+_persisted = gauge("bot_persist_records", "Write-behind records by outcome.")
+_persisted.set_function(lambda: persist_queue.flushed, outcome="flushed")
+_persisted.set_function(lambda: persist_queue.dropped, outcome="dropped")
+_state_size = gauge("bot_state_entries", "In-memory state store entries.")
+for _kind in ("langs", "recent"):
+    _state_size.set_function(lambda k=_kind: state.stats()[k], kind=_kind)
+_metrics_runner = None
+_warm_task = None
+_maintenance_task = None
+
+async def _summarize(previous: str, messages) -> str:
+    lines = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    content = (f"Current summary:\n{previous}\n\n" if previous else "") + f"New messages:\n{lines}"
+    async with chat_slots:
+        resp = await call("chat", "summary", lambda: _openai().chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": content}],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        ))
+    _count_usage(getattr(resp, "usage", None))
+    return resp.choices[0].message.content or ""
+
+summarizer = RollingSummarizer(_summarize)
+admission = Admission()
+reply_cache = SemanticReplyCache() if REPLY_CACHE else None
+if reply_cache is not None:
+    _reply_cache_gauge = gauge("bot_reply_cache", "Semantic reply cache statistics.")
+    for _stat in ("hits", "misses", "size", "hit_rate"):
+        _reply_cache_gauge.set_function(lambda s=_stat: reply_cache.stats()[s], stat=_stat)
+
+def _openai():
+    global oa
+    if oa is None:
+        oa = openai_client()
+    return oa
+
+def persist(user_id: int, chat_id: int, text: str, role: str, emb=None) -> bool:
+    return persist_queue.submit(new_record(str(user_id), str(chat_id), text, role, emb))
+
+class TurnTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        parts = [f"{k}={v * 1000:.0f}ms" for k, v in self.stages.items()]
+        parts.append(f"total={self.total() * 1000:.0f}ms")
+        return " ".join(parts)
+
+    def finish(self, kind: str) -> str:
+        TURNS.inc(kind=kind)
+        for name, value in self.stages.items():
+            TURN_STAGE_SECONDS.observe(value, stage=name)
+        TURN_STAGE_SECONDS.observe(self.total(), stage="total")
+        return f"{kind} {self.summary()}"
 
 def _shrink_reply(text: str, max_sentences: int = REPLY_MAX_SENTENCES, max_words: int = REPLY_MAX_WORDS) -> str:
     if not isinstance(text, str):
@@ -167,7 +300,7 @@ def _shrink_reply(text: str, max_sentences: int = REPLY_MAX_SENTENCES, max_words
         sents = sents[1:]
     seen, dedup = set(), []
     for s in sents:
-        key = re.sub(r'\s+', ' ', s.lower())
+        key = _SPACES_RE.sub(' ', s.lower())
         if key not in seen:
             seen.add(key)
             dedup.append(s)
@@ -177,34 +310,49 @@ def _shrink_reply(text: str, max_sentences: int = REPLY_MAX_SENTENCES, max_words
         return " ".join(words[:max_words]).rstrip(",.;:!—- ") + "…"
     return " ".join(clipped).strip()
 
-def _detect_msg_lang(text: str, fallback: str = "en") -> str:
-    if not isinstance(text, str):
-        return fallback
-    t = text.lower()
-    if _CYRILLIC_RE.search(t):
+def _reply_capped(text: str, max_sentences: int = REPLY_MAX_SENTENCES, max_words: int = REPLY_MAX_WORDS) -> bool:
+    if len(text.split()) > max_words + 10:
+        return True
+    sents = [s for s in _SENT_SPLIT.split(text.strip()) if s.strip()]
+    return len(sents) > max_sentences + 1
+
+class MessageFlags(NamedTuple):
+    lang: str
+    smalltalk: bool
+    safety: bool
+
+def _lang_of(lowered: str) -> str:
+    if _CYRILLIC_RE.search(lowered):
         return "ru"
-    if re.search(r"\b(come|stai|sto|va|grazie|perch[eè]|quest[oa]|aiuto|cosa|penso|sent[io])\b", t):
+    if _ITALIAN_RE.search(lowered):
         return "it"
     return "en"
 
+def classify_message(text: str, fallback: str = "en") -> MessageFlags:
+    if not isinstance(text, str):
+        return MessageFlags(fallback, False, False)
+    t = text.lower()
+    lang = _lang_of(t)
+    return MessageFlags(lang, _SMALLTALK_RE[lang].search(t) is not None, _SAFETY_LOWER_RE.search(t) is not None)
+
+def _detect_msg_lang(text: str, fallback: str = "en") -> str:
+    if not isinstance(text, str):
+        return fallback
+    return _lang_of(text.lower())
+
 async def set_lang(user_id: int, lang: str):
-    async with state_lock:
-        USER_LANG[user_id] = lang
+    await state.set_lang(user_id, lang)
 
 async def get_lang(user_id: int) -> str:
-    async with state_lock:
-        return USER_LANG[user_id]
+    return await state.get_lang(user_id)
 
 async def recent_add(chat_id: int, text: str):
-    if not text:
-        return
-    async with state_lock:
-        RECENT_CACHE[chat_id].appendleft(text)
+    await state.recent_add(chat_id, text)
 
 async def recent_get(chat_id: int):
-    async with state_lock:
-        return list(RECENT_CACHE[chat_id])
+    return await state.recent_get(chat_id)
 
+@lru_cache(maxsize=8)
 def menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.row(InlineKeyboardButton(text=("❓ Help" if lang == "en" else "❓ Помощь" if lang == "ru" else "❓ Aiuto"),
@@ -219,6 +367,7 @@ def menu_keyboard(lang: str) -> InlineKeyboardMarkup:
                                 callback_data="language"))
     return kb.as_markup()
 
+@lru_cache(maxsize=1)
 def lang_choice_keyboard() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.row(InlineKeyboardButton(text=LANGUAGES["en"]["lang_en"], callback_data="setlang_en"))
@@ -227,8 +376,10 @@ def lang_choice_keyboard() -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 def _is_smalltalk(text: str, lang: str) -> bool:
-    patt = _SMALLTALK_PATTERNS.get(lang, _SMALLTALK_PATTERNS["en"])
-    return re.search(patt, text.lower()) is not None
+    return _SMALLTALK_RE.get(lang, _SMALLTALK_RE["en"]).search(text.lower()) is not None
+
+def _is_safety_sensitive(text: str) -> bool:
+    return _SAFETY_LOWER_RE.search(text.lower()) is not None
 
 def _smalltalk_reply(lang: str) -> str:
     return _SMALLTALK_REPLY.get(lang, _SMALLTALK_REPLY["en"])
@@ -258,12 +409,12 @@ async def on_callbacks(query: CallbackQuery, bot: Bot):
                 joined = "\n— ".join(cached[:3])
                 await query.message.answer(LANGUAGES[lang]["recent"] + joined, reply_markup=menu_keyboard(lang))
             else:
-                msgs = await run_blocking(get_recent_user_messages, str(chat_id), 3)
+                msgs = await get_recent_user_messages(str(chat_id), 3)
                 if msgs:
                     joined = "\n— ".join([m["content"] for m in msgs])
                     await query.message.answer(LANGUAGES[lang]["recent"] + joined, reply_markup=menu_keyboard(lang))
                 else:
-                    any_msgs = await run_blocking(get_recent_history, str(chat_id), 3)
+                    any_msgs = await get_recent_history(str(chat_id), 3)
                     if any_msgs:
                         joined = "\n— ".join([m["content"] for m in any_msgs])
                         await query.message.answer(LANGUAGES[lang]["recent"] + joined, reply_markup=menu_keyboard(lang))
@@ -271,9 +422,9 @@ async def on_callbacks(query: CallbackQuery, bot: Bot):
                         await query.message.answer(LANGUAGES[lang]["recent_none"], reply_markup=menu_keyboard(lang))
 
         elif data == "clear":
-            ok = await run_blocking(clear_memory, str(chat_id))
-            async with state_lock:
-                RECENT_CACHE[chat_id].clear()
+            summarizer.forget(str(chat_id))
+            ok = await clear_memory(str(chat_id), persist_queue)
+            await state.recent_clear(chat_id)
             msg = LANGUAGES[lang]["cleared"] if ok else LANGUAGES[lang]["nothing_clear"]
             await query.message.answer(msg, reply_markup=menu_keyboard(lang))
 
@@ -293,83 +444,329 @@ async def on_callbacks(query: CallbackQuery, bot: Bot):
         logger.error(f"Callback error: {e}", exc_info=True)
         await query.message.answer("Internal error. Please try again.", reply_markup=menu_keyboard(lang))
 
-async def on_text(message: Message, bot: Bot):
-    user_id = message.from_user.id
+def _count_usage(usage):
+    if usage is None:
+        return
+    CHAT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+    CHAT_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+
+async def _edit_reply(bot: Bot, chat_id: int, message_id: int, text: str, reply_markup=None) -> float:
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+    except TelegramRetryAfter as e:
+        return float(e.retry_after)
+    except TelegramBadRequest as e:
+        if "not modified" not in str(e):
+            logger.error(f"Edit reply error: {e}", exc_info=True)
+    return 0.0
+
+async def _stream_reply(bot: Bot, turn: Turn, msgs, lang: str, timer: "TurnTimer", model: str = MODEL_NAME) -> str:
+    message = turn.message
     chat_id = message.chat.id
-    lang = await get_lang(user_id)
-    user_msg = message.text or ""
+    loop = asyncio.get_running_loop()
+    turn.committed = True
+    placeholder = await message.answer(STREAM_PLACEHOLDER)
+    raw, shown = "", STREAM_PLACEHOLDER
+    next_edit = loop.time() + STREAM_EDIT_INTERVAL_SEC
+    try:
+        with timer.stage("llm"):
+            async with chat_slots:
+                stream = await call("chat", "chat_stream_open", lambda: _openai().chat.completions.create(
+                    model=model,
+                    messages=msgs,
+                    temperature=0.6,
+                    max_tokens=220,
+                    frequency_penalty=0.6,
+                    presence_penalty=0.2,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ))
+                async with asyncio.timeout(POLICIES["chat"].timeout):
+                    async for chunk in stream:
+                        _count_usage(getattr(chunk, "usage", None))
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if not delta:
+                            continue
+                        if not raw:
+                            timer.stages["ttft"] = timer.total()
+                        raw += delta
+                        if _reply_capped(raw):
+                            await stream.close()
+                            break
+                        if loop.time() >= next_edit:
+                            partial = _shrink_reply(raw, REPLY_MAX_SENTENCES, REPLY_MAX_WORDS)
+                            if partial and partial != shown:
+                                wait = await _edit_reply(bot, chat_id, placeholder.message_id, partial)
+                                if not wait:
+                                    shown = partial
+                                next_edit = loop.time() + STREAM_EDIT_INTERVAL_SEC + wait
+        reply = _shrink_reply(raw.strip(), REPLY_MAX_SENTENCES, REPLY_MAX_WORDS) if raw.strip() else ""
+    except Exception as e:
+        logger.error(f"OpenAI stream error: {e}", exc_info=True)
+        reply = _shrink_reply(raw.strip(), REPLY_MAX_SENTENCES, REPLY_MAX_WORDS) if raw.strip() else ""
+    if not reply:
+        reply = LANGUAGES[lang].get("error", "Sorry, a technical error occurred.")
 
+    with timer.stage("send"):
+        wait = await _edit_reply(bot, chat_id, placeholder.message_id, reply, reply_markup=menu_keyboard(lang))
+        if wait:
+            await asyncio.sleep(wait)
+            await _edit_reply(bot, chat_id, placeholder.message_id, reply, reply_markup=menu_keyboard(lang))
+    return reply
+
+async def on_text(message: Message, bot: Bot):
+    user_msg = message.text or ""
     if not (2 <= len(user_msg) <= 1500):
+        lang = await get_lang(message.from_user.id)
         await message.answer("Your message is too long or too short.", reply_markup=menu_keyboard(lang))
         return
+    coalescer.submit(message, bot, urgent=_is_safety_sensitive(user_msg))
+
+def _persist_user(turn: Turn, user_id: int, emb=None):
+    fresh = turn.unpersisted()
+    for text in fresh:
+        persist(user_id, turn.chat_id, text, "user", emb if fresh == [turn.text] else None)
+    return fresh
+
+async def _retrieve(chat_id: int, user_msg: str, emb):
+    if emb is None or is_open("vector"):
+        return None
+    return await get_relevant_history(str(chat_id), user_msg, 5, min_score=0.3, emb=emb)
+
+async def _run_turn(turn: Turn, bot: Bot):
+    with admission.turn(SAFETY if turn.urgent else INTERACTIVE) as decision:
+        await _serve_turn(turn, bot, decision)
+
+async def _serve_turn(turn: Turn, bot: Bot, decision: str):
+    message = turn.message
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    lang = await get_lang(user_id)
+    user_msg = turn.text
 
-    msg_lang = _detect_msg_lang(user_msg, fallback=lang)
+    flags = classify_message(user_msg, fallback=lang)
+    msg_lang = flags.lang
+    timer = TurnTimer()
 
-    if _is_smalltalk(user_msg, msg_lang):
+    if len(turn.messages) == 1 and flags.smalltalk and not flags.safety:
         reply = _smalltalk_reply(msg_lang)
-        await run_blocking(save_message, str(user_id), str(chat_id), user_msg, "user")
-        await recent_add(chat_id, user_msg)
-        await run_blocking(save_message, str(user_id), str(chat_id), reply, "assistant")
-        await message.answer(reply, reply_markup=menu_keyboard(lang))
+        turn.committed = True
+        with timer.stage("send"):
+            await message.answer(reply, reply_markup=menu_keyboard(lang))
+        for text in _persist_user(turn, user_id):
+            await recent_add(chat_id, text)
+        persist(user_id, chat_id, reply, "assistant")
+        logger.info(f"Turn chat={chat_id} {timer.finish('smalltalk')}")
         return
 
-    await run_blocking(save_message, str(user_id), str(chat_id), user_msg, "user")
-    await recent_add(chat_id, user_msg)
+    if decision == SHED:
+        turn.committed = True
+        with timer.stage("send"):
+            await message.answer(_BUSY_REPLY.get(msg_lang, _BUSY_REPLY["en"]), reply_markup=menu_keyboard(lang))
+        for text in _persist_user(turn, user_id):
+            await recent_add(chat_id, text)
+        logger.info(f"Turn chat={chat_id} {timer.finish('shed')}")
+        return
+
+    asyncio.create_task(bot.send_chat_action(chat_id, ChatAction.TYPING))
+
+    with timer.stage("embed"):
+        emb = await embed_query(user_msg, str(chat_id))
+    fresh = _persist_user(turn, user_id, emb)
+
+    with timer.stage("retrieve"):
+        history, summary, *_ = await asyncio.gather(
+            _retrieve(chat_id, user_msg, None if decision == DEGRADED else emb),
+            summarizer.get(str(chat_id)),
+            *(recent_add(chat_id, text) for text in fresh),
+        )
+    retrieved = history is not None
+    history = history or []
 
-    history = await run_blocking(get_relevant_history, str(chat_id), user_msg, 5, 4000, 0.3)
-    max_chars = 3000
     sys_prompt = LANGUAGES[lang]["system_prompt"]
     style_hint = STYLE_HINTS.get(msg_lang, STYLE_HINTS["en"])
+    msgs = build_messages(sys_prompt, style_hint, user_msg, history, summary)
 
-    msgs = [{"role": "system", "content": sys_prompt},
-            {"role": "system", "content": style_hint}]
-    total_len = 0
-    for h in history:
-        c = h.get("content", "")
-        if total_len + len(c) < max_chars:
-            msgs.append({"role": h.get("role", "user"), "content": c})
-            total_len += len(c)
-    msgs.append({"role": "user", "content": user_msg})
-
-    asyncio.create_task(bot.send_chat_action(chat_id, ChatAction.TYPING))
+    cache_lang = f"{lang}:{msg_lang}"
+    cacheable = (
+        reply_cache is not None and emb is not None and retrieved and not history and not is_open("vector")
+        and decision != DEGRADED
+        and not (summary and summary.get("text")) and not flags.safety
+    )
+    if cacheable:
+        cached = reply_cache.lookup(cache_lang, emb)
+        if cached is not None:
+            turn.committed = True
+            with timer.stage("send"):
+                await message.answer(cached, reply_markup=menu_keyboard(lang))
+            persist(user_id, chat_id, cached, "assistant")
+            logger.info(f"Turn chat={chat_id} {timer.finish('cached')}")
+            return
+
+    error_reply = LANGUAGES[lang].get("error", "Sorry, a technical error occurred.")
+    model = DEGRADED_MODEL if decision == DEGRADED else MODEL_NAME
+    if STREAM_REPLIES:
+        reply = await _stream_reply(bot, turn, msgs, lang, timer, model)
+        if cacheable and reply != error_reply:
+            reply_cache.store(cache_lang, emb, reply)
+        persist(user_id, chat_id, reply, "assistant")
+        summarizer.maybe_refresh(str(chat_id), summary)
+        logger.info(f"Turn chat={chat_id} history={len(history)} admit={decision} {timer.finish('stream')}")
+        return
 
     try:
-        def _call_openai():
-            resp = oa.chat.completions.create(
-                model=MODEL_NAME,
-                messages=msgs,
-                temperature=0.6,
-                max_tokens=220,
-                frequency_penalty=0.6,
-                presence_penalty=0.2,
-            )
-            return resp.choices[0].message.content.strip()
-
-        raw_reply = await run_blocking(_call_openai)
+        with timer.stage("llm"):
+            async with chat_slots:
+                resp = await call("chat", "chat", lambda: _openai().chat.completions.create(
+                    model=model,
+                    messages=msgs,
+                    temperature=0.6,
+                    max_tokens=220,
+                    frequency_penalty=0.6,
+                    presence_penalty=0.2,
+                ))
+        _count_usage(getattr(resp, "usage", None))
+        raw_reply = resp.choices[0].message.content.strip()
         reply = _shrink_reply(raw_reply, REPLY_MAX_SENTENCES, REPLY_MAX_WORDS)
+        if cacheable and reply:
+            reply_cache.store(cache_lang, emb, reply)
 
     except Exception as e:
         logger.error(f"OpenAI error: {e}", exc_info=True)
-        reply = LANGUAGES[lang].get("error", "Sorry, a technical error occurred.")
+        reply = error_reply
 
-    await run_blocking(save_message, str(user_id), str(chat_id), reply, "assistant")
-    await message.answer(reply, reply_markup=menu_keyboard(lang))
+    turn.committed = True
+    with timer.stage("send"):
+        await message.answer(reply, reply_markup=menu_keyboard(lang))
+    persist(user_id, chat_id, reply, "assistant")
+    summarizer.maybe_refresh(str(chat_id), summary)
+    logger.info(
+        f"Turn chat={chat_id} history={len(history)} merged={len(turn.messages)} admit={decision} {timer.finish('llm')}"
+    )
 
-async def main():
-    if not TELEGRAM_TOKEN:
-        raise RuntimeError("TELEGRAM_TOKEN is not set")
-    bot = Bot(
+def build_bot() -> Bot:
+    return Bot(
         token=TELEGRAM_TOKEN,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
-    dp = Dispatcher()
 
+def build_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
     dp.message.register(on_start, CommandStart())
     dp.callback_query.register(on_callbacks, F.data)
     dp.message.register(on_text, F.text)
-
+    return dp
+
+async def startup(metrics_port: int = METRICS_PORT, shard: int = 0, shards: int = 1):
+    global _metrics_runner, _warm_task, _maintenance_task
+    persist_queue.start()
+    state.start()
+    _warm_task = asyncio.create_task(warm_up())
+    if MAINTENANCE_IN_BOT:
+        _maintenance_task = asyncio.create_task(maintenance_loop(shard=shard, shards=shards), name="maintenance")
+    _metrics_runner = await serve_metrics(metrics_port)
+
+async def _until_fatal(aw):
+    main_task = asyncio.ensure_future(aw)
+    done, _ = await asyncio.wait({main_task, _warm_task}, return_when=asyncio.FIRST_COMPLETED)
+    if main_task not in done and not _warm_task.cancelled() and _warm_task.exception() is not None:
+        main_task.cancel()
+        await asyncio.gather(main_task, return_exceptions=True)
+        logger.critical(f"Stopping: {_warm_task.exception()}")
+        raise _warm_task.exception()
+    return await main_task
+
+async def shutdown():
+    global _metrics_runner, _warm_task, _maintenance_task
+    if _warm_task is not None and not _warm_task.done():
+        _warm_task.cancel()
+    _warm_task = None
+    if _maintenance_task is not None:
+        _maintenance_task.cancel()
+        await asyncio.gather(_maintenance_task, return_exceptions=True)
+    _maintenance_task = None
+    await coalescer.drain()
+    await summarizer.close()
+    await persist_queue.close()
+    await state.close()
+    await clients.aclose()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+
+async def run_polling():
+    bot, dp = build_bot(), build_dispatcher()
+    await startup()
     logger.info("Bot is running with aiogram 3 (async, non-blocking)…")
-    await dp.start_polling(bot, allowed_updates=["message", "callback_query"])
+    try:
+        await _until_fatal(dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES))
+    finally:
+        await shutdown()
+
+async def _set_webhook(bot: Bot):
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is not set")
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=ALLOWED_UPDATES,
+    )
+
+async def run_webhook():
+    bot, dp = build_bot(), build_dispatcher()
+    runner = ChatOrderedRunner(lambda update: dp.feed_raw_update(bot, update))
+    await startup()
+    web_runner = await serve(make_webhook_app(runner.dispatch))
+    await _set_webhook(bot)
+    logger.info(f"Bot is running in webhook mode on :{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await _until_fatal(wait_for_signal())
+    finally:
+        await web_runner.cleanup()
+        await runner.drain()
+        await shutdown()
+        await bot.session.close()
+
+async def run_worker(shard: int, queue):
+    bot, dp = build_bot(), build_dispatcher()
+    await startup(METRICS_PORT + 1 + shard if METRICS_PORT > 0 else 0, shard, SHARD_COUNT)
+    logger.info(f"Shard {shard} worker started (pid {os.getpid()})")
+    try:
+        await _until_fatal(consume_queue(queue, ChatOrderedRunner(lambda update: dp.feed_raw_update(bot, update))))
+    finally:
+        await shutdown()
+        await bot.session.close()
+
+def _worker_entry(shard: int, queue):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_worker(shard, queue))
+
+async def run_sharded():
+    if VECTOR_BACKEND == "pinecone":
+        await warm_up()
+        await clients.aclose()
+    router = ProcessShardRouter(_worker_entry, SHARD_COUNT)
+    router.start()
+    bot = build_bot()
+    web_runner = await serve(make_webhook_app(router.route))
+    try:
+        await _set_webhook(bot)
+        await bot.session.close()
+        logger.info(f"Bot is running in sharded webhook mode: {SHARD_COUNT} workers on :{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await wait_for_signal()
+    finally:
+        await web_runner.cleanup()
+        await asyncio.to_thread(router.stop)
+
+async def main():
+    if not TELEGRAM_TOKEN:
+        raise RuntimeError("TELEGRAM_TOKEN is not set")
+    if RUN_MODE == "webhook":
+        await run_webhook()
+    elif RUN_MODE == "sharded":
+        await run_sharded()
+    else:
+        await run_polling()
 
 if __name__ == "__main__":
     asyncio.run(main())
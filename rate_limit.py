@@ -0,0 +1,73 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Hashable
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = max(0.0, rate)
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        if self.unlimited:
+            return True
+        self._refill(time.monotonic())
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        if self.unlimited:
+            return 0.0
+        self._refill(time.monotonic())
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity
+
+    async def acquire(self, tokens: float = 1.0):
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.wait_time(tokens))
+
+
+class KeyedLimiter:
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        b = self._buckets.get(key)
+        if b is None:
+            b = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            self._prune()
+        else:
+            self._buckets.move_to_end(key)
+        return b
+
+    def _prune(self):
+        while len(self._buckets) > self.max_keys:
+            key, oldest = next(iter(self._buckets.items()))
+            if not oldest.idle() and len(self._buckets) <= self.max_keys * 2:
+                break
+            self._buckets.pop(key)
+
+    def try_acquire(self, key: Hashable, tokens: float = 1.0) -> bool:
+        return self.bucket(key).try_acquire(tokens)
+
+    async def acquire(self, key: Hashable, tokens: float = 1.0):
+        await self.bucket(key).acquire(tokens)
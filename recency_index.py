@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+RECENCY_DB = os.getenv("RECENCY_DB", os.path.join(DATA_DIR, "recent.sqlite"))
+RECENCY_RING_SIZE = int(os.getenv("RECENCY_RING_SIZE", "50"))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS recent ("
+    " id TEXT PRIMARY KEY,"
+    " chat_id TEXT NOT NULL,"
+    " role TEXT NOT NULL,"
+    " text TEXT NOT NULL,"
+    " ts REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS recent_chat_ts ON recent (chat_id, ts DESC)",
+    "CREATE INDEX IF NOT EXISTS recent_chat_role_ts ON recent (chat_id, role, ts DESC)",
+    "CREATE TABLE IF NOT EXISTS summary ("
+    " chat_id TEXT PRIMARY KEY,"
+    " text TEXT NOT NULL,"
+    " upto_ts REAL NOT NULL,"
+    " updated REAL NOT NULL)",
+)
+
+
+class RecencyIndex:
+    def __init__(self, db_path: Optional[str] = RECENCY_DB, ring_size: int = RECENCY_RING_SIZE):
+        self.ring_size = max(1, ring_size)
+        self._lock = threading.Lock()
+        if not db_path or not os.path.isdir(os.path.dirname(db_path) or "."):
+            db_path = ":memory:"
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        for stmt in _SCHEMA:
+            self._db.execute(stmt)
+
+    def add(self, records: Iterable[Dict[str, Any]]):
+        rows = []
+        for r in records:
+            meta = r["meta"]
+            rows.append((r["id"], str(meta["chat_id"]), meta["role"], meta["text"], float(meta["timestamp"])))
+        if not rows:
+            return
+        chats = {row[1] for row in rows}
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO recent (id, chat_id, role, text, ts) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                for chat_id in chats:
+                    self._db.execute(
+                        "DELETE FROM recent WHERE chat_id = ? AND ts < ("
+                        " SELECT MIN(ts) FROM ("
+                        "  SELECT ts FROM recent WHERE chat_id = ? ORDER BY ts DESC LIMIT ?))",
+                        (chat_id, chat_id, self.ring_size),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def latest(self, chat_id: str, limit: int, role: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            if role is None:
+                rows = self._db.execute(
+                    "SELECT role, text FROM recent WHERE chat_id = ? ORDER BY ts DESC LIMIT ?",
+                    (str(chat_id), limit),
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT role, text FROM recent WHERE chat_id = ? AND role = ? ORDER BY ts DESC LIMIT ?",
+                    (str(chat_id), role, limit),
+                ).fetchall()
+        return [{"role": r, "content": t} for r, t in rows]
+
+    def since(self, chat_id: str, ts: float, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, text, ts FROM recent WHERE chat_id = ? AND ts > ? ORDER BY ts ASC LIMIT ?",
+                (str(chat_id), ts, limit),
+            ).fetchall()
+        return [{"role": r, "content": t, "ts": at} for r, t, at in rows]
+
+    def count_since(self, chat_id: str, ts: float) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM recent WHERE chat_id = ? AND ts > ?", (str(chat_id), ts),
+            ).fetchone()[0]
+
+    def get_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text, upto_ts FROM summary WHERE chat_id = ?", (str(chat_id),),
+            ).fetchone()
+        return {"text": row[0], "upto_ts": row[1]} if row else None
+
+    def set_summary(self, chat_id: str, text: str, upto_ts: float):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summary (chat_id, text, upto_ts, updated) VALUES (?, ?, ?, ?)",
+                (str(chat_id), text, upto_ts, time.time()),
+            )
+
+    def clear(self, chat_id: str) -> int:
+        with self._lock:
+            cur = self._db.execute("DELETE FROM recent WHERE chat_id = ?", (str(chat_id),))
+            self._db.execute("DELETE FROM summary WHERE chat_id = ?", (str(chat_id),))
+            return cur.rowcount
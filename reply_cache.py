@@ -0,0 +1,139 @@
+import os
+import time
+import random
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+REPLY_CACHE = os.getenv("REPLY_CACHE", "0") == "1"
+REPLY_CACHE_THRESHOLD = float(os.getenv("REPLY_CACHE_THRESHOLD", "0.93"))
+REPLY_CACHE_TTL_SEC = float(os.getenv("REPLY_CACHE_TTL_SEC", str(24 * 3600)))
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "2000"))
+REPLY_CACHE_MIN_VARIANTS = int(os.getenv("REPLY_CACHE_MIN_VARIANTS", "2"))
+REPLY_CACHE_MAX_VARIANTS = int(os.getenv("REPLY_CACHE_MAX_VARIANTS", "5"))
+
+
+class _Entry:
+    __slots__ = ("replies", "created", "last_served")
+
+    def __init__(self, reply: str, created: float):
+        self.replies: List[str] = [reply]
+        self.created = created
+        self.last_served = -1
+
+
+class _Bucket:
+    def __init__(self):
+        self.entries: List[_Entry] = []
+        self.rows: List[np.ndarray] = []
+        self.matrix: Optional[np.ndarray] = None
+
+    def scores(self, q: np.ndarray) -> np.ndarray:
+        if self.matrix is None:
+            self.matrix = np.vstack(self.rows) if self.rows else np.zeros((0, q.shape[0]), dtype=np.float32)
+        return self.matrix @ q
+
+    def drop(self, keep: Sequence[int]):
+        self.entries = [self.entries[i] for i in keep]
+        self.rows = [self.rows[i] for i in keep]
+        self.matrix = None
+
+
+class SemanticReplyCache:
+    def __init__(
+        self,
+        threshold: float = REPLY_CACHE_THRESHOLD,
+        ttl: float = REPLY_CACHE_TTL_SEC,
+        max_entries: int = REPLY_CACHE_SIZE,
+        min_variants: int = REPLY_CACHE_MIN_VARIANTS,
+        max_variants: int = REPLY_CACHE_MAX_VARIANTS,
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.min_variants = max(1, min_variants)
+        self.max_variants = max(self.min_variants, max_variants)
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return sum(len(b.entries) for b in self._buckets.values())
+
+    @staticmethod
+    def _unit(emb: Sequence[float]) -> Optional[np.ndarray]:
+        q = np.asarray(emb, dtype=np.float32)
+        norm = float(np.linalg.norm(q))
+        return q / norm if norm > 0 else None
+
+    def _nearest(self, bucket: _Bucket, q: np.ndarray):
+        if not bucket.entries:
+            return None, 0.0
+        scores = bucket.scores(q)
+        i = int(np.argmax(scores))
+        return i, float(scores[i])
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created > self.ttl
+
+    def lookup(self, lang: str, emb: Sequence[float]) -> Optional[str]:
+        q = self._unit(emb)
+        with self._lock:
+            bucket = self._buckets.get(lang)
+            i, score = self._nearest(bucket, q) if bucket is not None and q is not None else (None, 0.0)
+            if i is None or score < self.threshold:
+                self.misses += 1
+                return None
+            entry = bucket.entries[i]
+            if self._expired(entry, time.time()) or len(entry.replies) < self.min_variants:
+                self.misses += 1
+                return None
+            choices = [j for j in range(len(entry.replies)) if j != entry.last_served] or [0]
+            entry.last_served = random.choice(choices)
+            self.hits += 1
+            return entry.replies[entry.last_served]
+
+    def store(self, lang: str, emb: Sequence[float], reply: str):
+        q = self._unit(emb)
+        if q is None or not reply:
+            return
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.setdefault(lang, _Bucket())
+            i, score = self._nearest(bucket, q)
+            if i is not None and score >= self.threshold and not self._expired(bucket.entries[i], now):
+                entry = bucket.entries[i]
+                if reply not in entry.replies and len(entry.replies) < self.max_variants:
+                    entry.replies.append(reply)
+                return
+            bucket.entries.append(_Entry(reply, now))
+            bucket.rows.append(q)
+            bucket.matrix = None
+            self._evict(now)
+
+    def _evict(self, now: float):
+        for bucket in self._buckets.values():
+            keep = [i for i, e in enumerate(bucket.entries) if not self._expired(e, now)]
+            if len(keep) != len(bucket.entries):
+                bucket.drop(keep)
+        overflow = len(self) - self.max_entries
+        if overflow <= 0:
+            return
+        ages = sorted((e.created, lang, i) for lang, b in self._buckets.items() for i, e in enumerate(b.entries))
+        doomed: Dict[str, set] = {}
+        for _, lang, i in ages[:overflow]:
+            doomed.setdefault(lang, set()).add(i)
+        for lang, idx in doomed.items():
+            bucket = self._buckets[lang]
+            bucket.drop([i for i in range(len(bucket.entries)) if i not in idx])
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self),
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
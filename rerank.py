@@ -0,0 +1,61 @@
+import os
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_POOL_FACTOR = int(os.getenv("MMR_POOL_FACTOR", "3"))
+
+
+def blend_scores(
+    similarity: np.ndarray,
+    timestamps: np.ndarray,
+    now_ts: float,
+    bias: float,
+    tau: float,
+) -> np.ndarray:
+    age = np.maximum(0.0, now_ts - timestamps)
+    recency = np.where(timestamps > 0, np.exp(-age / max(1.0, tau)), 0.0)
+    return (1.0 - bias) * similarity + bias * recency
+
+
+def top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def mmr_select(
+    relevance: np.ndarray,
+    vectors: Optional[Sequence[Sequence[float]]],
+    k: int,
+    lam: float = MMR_LAMBDA,
+    pool_factor: int = MMR_POOL_FACTOR,
+) -> List[int]:
+    pool = top_indices(relevance, max(k, k * max(1, pool_factor)) if vectors is not None and lam < 1.0 else k)
+    if vectors is None or lam >= 1.0 or len(pool) <= 1:
+        return pool[:k].tolist()
+
+    v = np.asarray([vectors[i] for i in pool], dtype=np.float32)
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    v = v / norms
+    gram = v @ v.T
+    rel = relevance[pool]
+
+    chosen = [0]
+    max_sim = gram[0].copy()
+    available = np.ones(len(pool), dtype=bool)
+    available[0] = False
+    while len(chosen) < min(k, len(pool)):
+        mmr = np.where(available, lam * rel - (1.0 - lam) * max_sim, -np.inf)
+        j = int(np.argmax(mmr))
+        chosen.append(j)
+        available[j] = False
+        np.maximum(max_sim, gram[j], out=max_sim)
+    return pool[chosen].tolist()
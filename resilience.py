@@ -0,0 +1,171 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import counter, gauge, track
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SEC = float(os.getenv("BREAKER_RESET_SEC", "30"))
+RETRY_BACKOFF_SEC = float(os.getenv("RETRY_BACKOFF_SEC", "0.2"))
+
+CHAT_TIMEOUT_SEC = float(os.getenv("CHAT_TIMEOUT_SEC", "30"))
+CHAT_RETRIES = int(os.getenv("CHAT_RETRIES", "1"))
+EMBED_TIMEOUT_SEC = float(os.getenv("EMBED_TIMEOUT_SEC", "8"))
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "2"))
+EMBED_HEDGE_SEC = float(os.getenv("EMBED_HEDGE_SEC", "1.0"))
+VECTOR_TIMEOUT_SEC = float(os.getenv("VECTOR_TIMEOUT_SEC", "4"))
+VECTOR_RETRIES = int(os.getenv("VECTOR_RETRIES", "2"))
+VECTOR_HEDGE_SEC = float(os.getenv("VECTOR_HEDGE_SEC", "0.3"))
+
+RETRIES = counter("bot_retries_total", "Retried outbound calls by dependency and operation.")
+HEDGES = counter("bot_hedged_requests_total", "Hedged (duplicate) read requests by dependency and operation.")
+REJECTED = counter("bot_breaker_rejections_total", "Calls short-circuited by an open breaker.")
+_breaker_state = gauge("bot_circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open).")
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class BreakerOpen(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset_after: float = BREAKER_RESET_SEC):
+        self.name = name
+        self.threshold = max(1, failures)
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = CLOSED
+        self._probing = False
+
+    @property
+    def state(self) -> int:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_after:
+            return HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN or self._probing:
+            return False
+        self._state = HALF_OPEN
+        self._probing = True
+        return True
+
+    def success(self):
+        if self._state != CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self.failures = 0
+        self._state = CLOSED
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self._state == HALF_OPEN or self.failures >= self.threshold:
+            if self._state != OPEN:
+                logger.error(f"Circuit {self.name} open after {self.failures} failures")
+            self._state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        self._probing = False
+
+
+class Policy:
+    def __init__(self, dep: str, timeout: float, retries: int, hedge_after: float = 0.0):
+        self.dep = dep
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.hedge_after = hedge_after
+
+
+POLICIES: Dict[str, Policy] = {
+    "chat": Policy("openai", CHAT_TIMEOUT_SEC, CHAT_RETRIES),
+    "embeddings": Policy("openai", EMBED_TIMEOUT_SEC, EMBED_RETRIES, EMBED_HEDGE_SEC),
+    "vector": Policy("vector", VECTOR_TIMEOUT_SEC, VECTOR_RETRIES, VECTOR_HEDGE_SEC),
+}
+BREAKERS: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in POLICIES}
+for _name, _breaker in BREAKERS.items():
+    _breaker_state.set_function(lambda b=_breaker: b.state, breaker=_name)
+
+
+def is_open(name: str) -> bool:
+    return BREAKERS[name].state == OPEN
+
+
+def _retryable(e: BaseException) -> bool:
+    if isinstance(e, (BreakerOpen, ValueError)):
+        return False
+    status = getattr(e, "status_code", None) or getattr(e, "status", None)
+    if isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429):
+        return False
+    return True
+
+
+async def _attempt(fn: Callable[[], Awaitable[Any]], policy: Policy, op: str) -> Any:
+    if policy.hedge_after <= 0 or policy.hedge_after >= policy.timeout:
+        return await asyncio.wait_for(fn(), policy.timeout)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.timeout
+    first = asyncio.ensure_future(fn())
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=policy.hedge_after)
+        if not done:
+            HEDGES.inc(dep=policy.dep, op=op)
+            tasks.add(asyncio.ensure_future(fn()))
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(
+                tasks, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                raise asyncio.TimeoutError()
+            for t in done:
+                if t.exception() is None:
+                    return t.result()
+                error = t.exception()
+        raise error
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def call(name: str, op: str, fn: Callable[[], Awaitable[Any]], hedge: bool = False) -> Any:
+    policy, breaker = POLICIES[name], BREAKERS[name]
+    if not breaker.allow():
+        REJECTED.inc(breaker=name)
+        raise BreakerOpen(f"{name} circuit is open")
+    attempt = 0
+    try:
+        while True:
+            try:
+                with track(policy.dep, op):
+                    if hedge:
+                        result = await _attempt(fn, policy, op)
+                    else:
+                        result = await asyncio.wait_for(fn(), policy.timeout)
+                breaker.success()
+                return result
+            except Exception as e:
+                if not _retryable(e):
+                    breaker.release()
+                    raise
+                if attempt >= policy.retries:
+                    breaker.failure()
+                    raise
+                attempt += 1
+                RETRIES.inc(dep=policy.dep, op=op)
+                await asyncio.sleep(RETRY_BACKOFF_SEC * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
@@ -0,0 +1,148 @@
+import os
+import heapq
+import asyncio
+import logging
+import itertools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from metrics import counter, gauge, histogram
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ADMIT_DEGRADE_DEPTH = int(os.getenv("ADMIT_DEGRADE_DEPTH", "0"))
+ADMIT_SHED_DEPTH = int(os.getenv("ADMIT_SHED_DEPTH", "0"))
+
+SAFETY, INTERACTIVE, BACKGROUND = 0, 1, 2
+LANES = {SAFETY: "safety", INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+NORMAL, DEGRADED, SHED = "normal", "degraded", "shed"
+
+QUEUE_WAIT = histogram(
+    "bot_queue_wait_seconds", "Time spent waiting for a priority gate slot.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+ADMISSIONS = counter("bot_admissions_total", "Turn admission decisions by lane.")
+_waiting_gauge = gauge("bot_queue_waiting", "Requests waiting for a priority gate slot.")
+_inflight_gauge = gauge("bot_turns_inflight", "Turns currently being processed.")
+
+_lane: contextvars.ContextVar[int] = contextvars.ContextVar("lane", default=INTERACTIVE)
+
+
+def current_lane() -> int:
+    return _lane.get()
+
+
+@contextmanager
+def lane(value: int):
+    token = _lane.set(value)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def set_lane(value: int):
+    _lane.set(value)
+
+
+class PriorityGate:
+    def __init__(self, name: str, capacity: int, rate: Optional[TokenBucket] = None):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.rate = rate
+        self._free = self.capacity
+        self._heap: List[Tuple[int, int, asyncio.Future, float]] = []
+        self._seq = itertools.count()
+        self._waiting: Dict[int, int] = {k: 0 for k in LANES}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        for k, label in LANES.items():
+            _waiting_gauge.set_function(lambda k=k: self._waiting[k], gate=name, lane=label)
+
+    def waiting(self, upto: int = BACKGROUND) -> int:
+        return sum(n for k, n in self._waiting.items() if k <= upto)
+
+    def in_use(self) -> int:
+        return self.capacity - self._free
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        prio = current_lane()
+        if self._free > 0 and not self._heap and (self.rate is None or self.rate.try_acquire()):
+            self._free -= 1
+            QUEUE_WAIT.observe(0.0, gate=self.name, lane=LANES[prio])
+            return
+        fut = loop.create_future()
+        heapq.heappush(self._heap, (prio, next(self._seq), fut, loop.time()))
+        self._waiting[prio] += 1
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                self._waiting[prio] -= 1
+            raise
+
+    def release(self):
+        self._free += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self._heap and self._free > 0:
+            prio, _, fut, queued_at = self._heap[0]
+            if fut.done():
+                heapq.heappop(self._heap)
+                continue
+            if self.rate is not None and not self.rate.try_acquire():
+                if self._timer is None:
+                    self._timer = loop.call_later(max(0.001, self.rate.wait_time()), self._wake)
+                return
+            heapq.heappop(self._heap)
+            self._waiting[prio] -= 1
+            self._free -= 1
+            fut.set_result(None)
+            QUEUE_WAIT.observe(loop.time() - queued_at, gate=self.name, lane=LANES[prio])
+
+    def _wake(self):
+        self._timer = None
+        self._dispatch()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class Admission:
+    def __init__(self, degrade_depth: int = ADMIT_DEGRADE_DEPTH, shed_depth: int = ADMIT_SHED_DEPTH):
+        self.degrade_depth = degrade_depth
+        self.shed_depth = shed_depth
+        self.inflight = 0
+        _inflight_gauge.set_function(lambda: self.inflight)
+
+    def decide(self, prio: int) -> str:
+        if prio == SAFETY:
+            return NORMAL
+        if self.shed_depth > 0 and self.inflight >= self.shed_depth:
+            return SHED
+        if self.degrade_depth > 0 and self.inflight >= self.degrade_depth:
+            return DEGRADED
+        return NORMAL
+
+    @contextmanager
+    def turn(self, prio: int):
+        decision = self.decide(prio)
+        ADMISSIONS.inc(lane=LANES[prio], decision=decision)
+        self.inflight += 1
+        try:
+            with lane(prio):
+                yield decision
+        finally:
+            self.inflight -= 1
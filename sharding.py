@@ -0,0 +1,152 @@
+import os
+import hmac
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", str(os.cpu_count() or 1)))
+
+UpdateHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        chat = (update.get(key) or {}).get("chat") or {}
+        if "id" in chat:
+            return int(chat["id"])
+    cq = update.get("callback_query") or {}
+    chat = (cq.get("message") or {}).get("chat") or {}
+    if "id" in chat:
+        return int(chat["id"])
+    for value in update.values():
+        if isinstance(value, dict) and "id" in (value.get("from") or {}):
+            return int(value["from"]["id"])
+    return 0
+
+
+def shard_for(chat_id: int, shards: int) -> int:
+    return abs(int(chat_id)) % max(1, shards)
+
+
+class ChatOrderedRunner:
+    def __init__(self, handle: UpdateHandler):
+        self._handle = handle
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def pending(self) -> int:
+        return len(self._tails)
+
+    def dispatch(self, update: Dict[str, Any]):
+        chat_id = update_chat_id(update)
+        previous = self._tails.get(chat_id)
+        task = asyncio.create_task(self._run(chat_id, update, previous))
+        self._tails[chat_id] = task
+
+    async def _run(self, chat_id: int, update: Dict[str, Any], previous: Optional[asyncio.Task]):
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        try:
+            await self._handle(update)
+        except Exception as e:
+            logger.error(f"Update {update.get('update_id')} error: {e}", exc_info=True)
+        finally:
+            if self._tails.get(chat_id) is asyncio.current_task():
+                del self._tails[chat_id]
+
+    async def drain(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+class LocalShardRouter:
+    def __init__(self, handlers: List[UpdateHandler]):
+        self._runners = [ChatOrderedRunner(h) for h in handlers]
+        self.routed = [0] * len(handlers)
+
+    def route(self, update: Dict[str, Any]):
+        shard = shard_for(update_chat_id(update), len(self._runners))
+        self.routed[shard] += 1
+        self._runners[shard].dispatch(update)
+
+    async def drain(self):
+        await asyncio.gather(*(r.drain() for r in self._runners))
+
+
+class ProcessShardRouter:
+    def __init__(self, worker: Callable[[int, Any], None], shards: int = SHARD_COUNT):
+        ctx = multiprocessing.get_context("spawn")
+        self._queues = [ctx.Queue() for _ in range(max(1, shards))]
+        self._procs = [
+            ctx.Process(target=worker, args=(i, q), name=f"bot-shard-{i}", daemon=False)
+            for i, q in enumerate(self._queues)
+        ]
+
+    def start(self):
+        for p in self._procs:
+            p.start()
+
+    def route(self, update: Dict[str, Any]):
+        self._queues[shard_for(update_chat_id(update), len(self._queues))].put(update)
+
+    def stop(self, timeout: float = 60.0):
+        for q in self._queues:
+            q.put(None)
+        for p in self._procs:
+            p.join(timeout)
+            if p.is_alive():
+                logger.error(f"{p.name} did not stop in {timeout}s; terminating")
+                p.terminate()
+
+
+async def consume_queue(queue, runner: ChatOrderedRunner):
+    while True:
+        update = await asyncio.to_thread(queue.get)
+        if update is None:
+            break
+        runner.dispatch(update)
+    await runner.drain()
+
+
+def make_webhook_app(route: Callable[[Dict[str, Any]], None], secret: str = WEBHOOK_SECRET) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        route(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    return app
+
+
+async def serve(app: web.Application, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def wait_for_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    await stop.wait()
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+STATE_DB = os.getenv("STATE_DB", os.path.join(DATA_DIR, "state.sqlite"))
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "50000"))
+STATE_TTL_SEC = int(os.getenv("STATE_TTL_SEC", str(30 * 24 * 3600)))
+STATE_LOCK_STRIPES = int(os.getenv("STATE_LOCK_STRIPES", "64"))
+STATE_FLUSH_SEC = float(os.getenv("STATE_FLUSH_SEC", "5"))
+RECENT_CACHE_LEN = int(os.getenv("RECENT_CACHE_LEN", "5"))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS user_lang (user_id TEXT PRIMARY KEY, lang TEXT NOT NULL, updated REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS recent_cache (chat_id TEXT PRIMARY KEY, items TEXT NOT NULL, updated REAL NOT NULL)",
+)
+
+_MISSING = object()
+
+
+class _TTLCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default=_MISSING):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, touched = item
+        now = time.time()
+        if self.ttl > 0 and now - touched > self.ttl:
+            del self._data[key]
+            return default
+        self._data[key] = (value, now)
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.time())
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def sweep(self) -> int:
+        if self.ttl <= 0:
+            return 0
+        cutoff = time.time() - self.ttl
+        expired = 0
+        while self._data:
+            key, (_, touched) = next(iter(self._data.items()))
+            if touched >= cutoff:
+                break
+            del self._data[key]
+            expired += 1
+        return expired
+
+
+class StateStore:
+    def __init__(
+        self,
+        db_path: Optional[str] = STATE_DB,
+        default_lang: str = "en",
+        max_entries: int = STATE_MAX_ENTRIES,
+        ttl: float = STATE_TTL_SEC,
+        stripes: int = STATE_LOCK_STRIPES,
+        recent_len: int = RECENT_CACHE_LEN,
+    ):
+        self.default_lang = default_lang
+        self.recent_len = recent_len
+        self.ttl = ttl
+        self._langs = _TTLCache(max_entries, ttl)
+        self._recent = _TTLCache(max_entries, ttl)
+        self._locks = [asyncio.Lock() for _ in range(max(1, stripes))]
+        self._dirty_langs: Dict[str, str] = {}
+        self._dirty_recent: Dict[str, Optional[List[str]]] = {}
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        if db_path and os.path.isdir(os.path.dirname(db_path) or "."):
+            try:
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                for stmt in _SCHEMA:
+                    self._db.execute(stmt)
+            except Exception as e:
+                logger.error(f"State store open error: {e}", exc_info=True)
+                self._db = None
+
+    def _lock(self, kind: str, key: Hashable) -> asyncio.Lock:
+        return self._locks[hash((kind, key)) % len(self._locks)]
+
+    def _read(self, sql: str, params: Tuple):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchone()
+
+    async def get_lang(self, user_id: int) -> str:
+        lang = self._langs.get(user_id)
+        if lang is not _MISSING:
+            return lang
+        async with self._lock("lang", user_id):
+            lang = self._langs.get(user_id)
+            if lang is not _MISSING:
+                return lang
+            row = await asyncio.to_thread(self._read, "SELECT lang FROM user_lang WHERE user_id = ?", (str(user_id),))
+            lang = row[0] if row is not None else self.default_lang
+            self._langs.set(user_id, lang)
+            return lang
+
+    async def set_lang(self, user_id: int, lang: str):
+        async with self._lock("lang", user_id):
+            self._langs.set(user_id, lang)
+            self._dirty_langs[str(user_id)] = lang
+
+    async def _load_recent(self, chat_id: int) -> deque:
+        items = self._recent.get(chat_id)
+        if items is not _MISSING:
+            return items
+        row = await asyncio.to_thread(
+            self._read,
+            "SELECT items FROM recent_cache WHERE chat_id = ? AND updated >= ?",
+            (str(chat_id), time.time() - self.ttl if self.ttl > 0 else 0),
+        )
+        items = deque(json.loads(row[0]) if row is not None else [], maxlen=self.recent_len)
+        self._recent.set(chat_id, items)
+        return items
+
+    async def recent_add(self, chat_id: int, text: str):
+        if not text:
+            return
+        async with self._lock("recent", chat_id):
+            items = await self._load_recent(chat_id)
+            items.appendleft(text)
+            self._dirty_recent[str(chat_id)] = list(items)
+
+    async def recent_get(self, chat_id: int) -> List[str]:
+        async with self._lock("recent", chat_id):
+            items = await self._load_recent(chat_id)
+            return list(items)
+
+    async def recent_clear(self, chat_id: int):
+        async with self._lock("recent", chat_id):
+            self._recent.set(chat_id, deque(maxlen=self.recent_len))
+            self._dirty_recent[str(chat_id)] = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "langs": len(self._langs),
+            "recent": len(self._recent),
+            "dirty": len(self._dirty_langs) + len(self._dirty_recent),
+        }
+
+    def _write(self, langs: Dict[str, str], recent: Dict[str, Optional[List[str]]]):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO user_lang (user_id, lang, updated) VALUES (?, ?, ?)",
+                    [(k, v, now) for k, v in langs.items()],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO recent_cache (chat_id, items, updated) VALUES (?, ?, ?)",
+                    [(k, json.dumps(v, ensure_ascii=False), now) for k, v in recent.items() if v is not None],
+                )
+                self._db.executemany(
+                    "DELETE FROM recent_cache WHERE chat_id = ?",
+                    [(k,) for k, v in recent.items() if v is None],
+                )
+                if self.ttl > 0:
+                    self._db.execute("DELETE FROM recent_cache WHERE updated < ?", (now - self.ttl,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    async def flush(self):
+        self._langs.sweep()
+        self._recent.sweep()
+        if self._db is None or not (self._dirty_langs or self._dirty_recent):
+            self._dirty_langs.clear()
+            self._dirty_recent.clear()
+            return
+        langs, self._dirty_langs = self._dirty_langs, {}
+        recent, self._dirty_recent = self._dirty_recent, {}
+        try:
+            await asyncio.to_thread(self._write, langs, recent)
+        except Exception as e:
+            logger.error(f"State store flush error: {e}", exc_info=True)
+            for k, v in langs.items():
+                self._dirty_langs.setdefault(k, v)
+            for k, v in recent.items():
+                self._dirty_recent.setdefault(k, v)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(STATE_FLUSH_SEC)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="state-store-flush")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
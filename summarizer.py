@@ -0,0 +1,85 @@
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from memory_pinecone import get_summary, set_summary, get_messages_since, count_messages_since
+from metrics import counter
+from scheduler import BACKGROUND, set_lane
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_EVERY = int(os.getenv("SUMMARY_EVERY", "12"))
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "4"))
+SUMMARY_MAX_MESSAGES = int(os.getenv("SUMMARY_MAX_MESSAGES", "40"))
+
+SummarizeFn = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+SUMMARIES = counter("bot_summaries_total", "Rolling summary refreshes by outcome.")
+
+
+class RollingSummarizer:
+    def __init__(
+        self,
+        summarize: SummarizeFn,
+        every: int = SUMMARY_EVERY,
+        keep_recent: int = SUMMARY_KEEP_RECENT,
+        max_messages: int = SUMMARY_MAX_MESSAGES,
+    ):
+        self._summarize = summarize
+        self.every = every
+        self.keep_recent = max(0, keep_recent)
+        self.max_messages = max(self.every + self.keep_recent, max_messages)
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.every > 0
+
+    async def get(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        return await get_summary(chat_id)
+
+    def maybe_refresh(self, chat_id: str, current: Optional[Dict[str, Any]] = None):
+        if not self.enabled or chat_id in self._tasks:
+            return
+        task = asyncio.create_task(self._refresh(chat_id, current))
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(chat_id, None) if self._tasks.get(chat_id) is t else None)
+
+    def forget(self, chat_id: str):
+        task = self._tasks.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _refresh(self, chat_id: str, current: Optional[Dict[str, Any]]):
+        set_lane(BACKGROUND)
+        upto = float((current or {}).get("upto_ts") or 0.0)
+        try:
+            if await count_messages_since(chat_id, upto) < self.every + self.keep_recent:
+                return
+            messages = await get_messages_since(chat_id, upto, self.max_messages)
+            fold = messages[:len(messages) - self.keep_recent]
+            if not fold:
+                return
+            text = (await self._summarize((current or {}).get("text") or "", fold)).strip()
+            if not text:
+                SUMMARIES.inc(outcome="empty")
+                return
+            await set_summary(chat_id, text, float(fold[-1]["ts"]))
+            SUMMARIES.inc(outcome="ok")
+            logger.info(f"Summary chat={chat_id} folded={len(fold)} upto={fold[-1]['ts']:.0f}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            SUMMARIES.inc(outcome="error")
+            logger.error(f"Summary refresh error (chat {chat_id}): {e}", exc_info=True)
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,710 @@
+import os
+import json
+import fcntl
+import asyncio
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from clients import http_session, vector_slots
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "/app/data")
+LOCAL_VECTOR_DIR = os.getenv("LOCAL_VECTOR_DIR", os.path.join(DATA_DIR, "vectors"))
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32").lower()
+LOCAL_SNAPSHOT_EVERY = int(os.getenv("LOCAL_SNAPSHOT_EVERY", "500"))
+PINECONE_API_VERSION = os.getenv("PINECONE_API_VERSION", "2024-07")
+PINECONE_CONTROL_URL = os.getenv("PINECONE_CONTROL_URL", "https://api.pinecone.io")
+PINECONE_HOST = os.getenv("PINECONE_HOST", "")
+PINECONE_HOST_CACHE = os.getenv("PINECONE_HOST_CACHE", os.path.join(DATA_DIR, "pinecone_hosts.json"))
+PINECONE_READY_TIMEOUT_SEC = float(os.getenv("PINECONE_READY_TIMEOUT_SEC", "120"))
+
+Vector = Tuple[str, List[float], Dict[str, Any]]
+
+
+class DimensionMismatch(ValueError):
+    pass
+
+
+class VectorStore(ABC):
+    @abstractmethod
+    async def upsert(self, vectors: List[Vector], namespace: str = "") -> None:
+        ...
+
+    @abstractmethod
+    async def query(
+        self,
+        vector: List[float],
+        filter: Dict[str, Any],
+        top_k: int,
+        include_values: bool = False,
+        namespace: str = "",
+    ) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def delete(self, filter: Dict[str, Any], namespace: str = "") -> None:
+        ...
+
+    @abstractmethod
+    async def drop_namespace(self, namespace: str) -> None:
+        ...
+
+    @abstractmethod
+    async def list_ids(
+        self, prefix: str, limit: int = 100, token: Optional[str] = None, namespace: str = "",
+    ) -> Tuple[List[str], Optional[str]]:
+        ...
+
+    @abstractmethod
+    async def fetch(self, ids: List[str], namespace: str = "") -> Dict[str, Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def delete_ids(self, ids: List[str], namespace: str = "") -> None:
+        ...
+
+    @abstractmethod
+    async def list_namespaces(self) -> List[str]:
+        ...
+
+    async def warm(self) -> None:
+        pass
+
+
+class PineconeStore(VectorStore):
+    def __init__(
+        self,
+        api_key: Optional[str],
+        index_name: str,
+        dimension: int,
+        cloud: str,
+        region: str,
+        host: str = PINECONE_HOST,
+        host_cache: Optional[str] = PINECONE_HOST_CACHE,
+    ):
+        self._api_key = api_key or ""
+        self.index_name = index_name
+        self.dimension = dimension
+        self._spec = {"serverless": {"cloud": cloud, "region": region}}
+        self._host_cache = host_cache
+        self._base_url: Optional[str] = self._url(host) if host else None
+        self._ready: Optional[asyncio.Lock] = None
+        self._verified = False
+        self._mismatch: Optional[DimensionMismatch] = None
+
+    @staticmethod
+    def _url(host: str) -> str:
+        return host if host.startswith("http") else "https://" + host
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Api-Key": self._api_key,
+            "Content-Type": "application/json",
+            "X-Pinecone-API-Version": PINECONE_API_VERSION,
+        }
+
+    def _read_host_cache(self) -> Dict[str, str]:
+        if not self._host_cache or not os.path.exists(self._host_cache):
+            return {}
+        try:
+            with open(self._host_cache, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Pinecone host cache read error: {e}", exc_info=True)
+            return {}
+
+    def _write_host_cache(self, host: Optional[str]):
+        if not self._host_cache or not os.path.isdir(os.path.dirname(self._host_cache) or "."):
+            return
+        hosts = self._read_host_cache()
+        if host:
+            hosts[self.index_name] = host
+        else:
+            hosts.pop(self.index_name, None)
+        try:
+            with open(self._host_cache + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(hosts, f)
+            os.replace(self._host_cache + ".tmp", self._host_cache)
+        except Exception as e:
+            logger.error(f"Pinecone host cache write error: {e}", exc_info=True)
+
+    async def _control(self, method: str, path: str, body: Optional[Dict[str, Any]] = None):
+        url = PINECONE_CONTROL_URL.rstrip("/") + path
+        async with http_session().request(method, url, json=body, headers=self._headers()) as resp:
+            if resp.status == 404:
+                return None
+            if resp.status >= 400:
+                raise RuntimeError(f"Pinecone {method} {path} failed: HTTP {resp.status} {await resp.text()}")
+            return await resp.json(content_type=None) or {}
+
+    async def _resolve_host(self) -> str:
+        path = f"/indexes/{self.index_name}"
+        desc = await self._control("GET", path)
+        if desc is None:
+            logger.info(f"Creating Pinecone index {self.index_name} (dimension {self.dimension})")
+            await self._control("POST", "/indexes", {
+                "name": self.index_name,
+                "dimension": self.dimension,
+                "metric": "cosine",
+                "spec": self._spec,
+            })
+            desc = await self._control("GET", path) or {}
+        deadline = asyncio.get_running_loop().time() + PINECONE_READY_TIMEOUT_SEC
+        while not (desc.get("status") or {}).get("ready", True) or not desc.get("host"):
+            if asyncio.get_running_loop().time() > deadline:
+                raise RuntimeError(f"Pinecone index {self.index_name} not ready after {PINECONE_READY_TIMEOUT_SEC}s")
+            await asyncio.sleep(1.0)
+            desc = await self._control("GET", path) or {}
+        return desc["host"]
+
+    async def _check_dimension(self, base_url: str):
+        async with http_session().post(base_url + "/describe_index_stats", json={}, headers=self._headers()) as resp:
+            if resp.status >= 400:
+                raise RuntimeError(f"Pinecone /describe_index_stats failed: HTTP {resp.status} {await resp.text()}")
+            stats = await resp.json(content_type=None) or {}
+        if stats.get("dimension") and int(stats["dimension"]) != self.dimension:
+            raise DimensionMismatch(
+                f"Pinecone index {self.index_name} has dimension {stats['dimension']}, but DIMENSION is {self.dimension}"
+            )
+
+    async def _ensure_ready(self) -> str:
+        if self._base_url is not None and self._verified:
+            return self._base_url
+        if self._ready is None:
+            self._ready = asyncio.Lock()
+        async with self._ready:
+            if self._mismatch is not None:
+                raise self._mismatch
+            if self._base_url is None:
+                host = self._read_host_cache().get(self.index_name)
+                if not host:
+                    host = await self._resolve_host()
+                    self._write_host_cache(host)
+                self._base_url = self._url(host)
+                self._verified = False
+            if not self._verified:
+                try:
+                    await self._check_dimension(self._base_url)
+                except DimensionMismatch as e:
+                    self._mismatch = e
+                    raise
+                self._verified = True
+        return self._base_url
+
+    async def warm(self) -> None:
+        await self._ensure_ready()
+
+    async def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._request("POST", path, json=body)
+
+    async def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        base_url = await self._ensure_ready()
+        async with vector_slots:
+            async with http_session().request(method, base_url + path, headers=self._headers(), **kwargs) as resp:
+                if resp.status == 404:
+                    if path == "/vectors/delete":
+                        return {}
+                    self._base_url = None
+                    self._write_host_cache(None)
+                if resp.status >= 400:
+                    raise RuntimeError(f"Pinecone {path} failed: HTTP {resp.status} {await resp.text()}")
+                return await resp.json(content_type=None) or {}
+
+    async def upsert(self, vectors: List[Vector], namespace: str = "") -> None:
+        await self._post("/vectors/upsert", {
+            "vectors": [{"id": vid, "values": list(values), "metadata": meta} for vid, values, meta in vectors],
+            "namespace": namespace,
+        })
+
+    async def query(self, vector, filter, top_k, include_values=False, namespace=""):
+        body = {
+            "vector": list(vector),
+            "topK": top_k,
+            "includeMetadata": True,
+            "includeValues": include_values,
+            "namespace": namespace,
+        }
+        if filter:
+            body["filter"] = filter
+        res = await self._post("/query", body)
+        matches = []
+        for m in res.get("matches", []):
+            matches.append({
+                "id": m.get("id"),
+                "score": m.get("score"),
+                "metadata": m.get("metadata") or {},
+                "values": m.get("values") or [],
+            })
+        return {"matches": matches}
+
+    async def delete(self, filter, namespace=""):
+        await self._post("/vectors/delete", {"filter": filter, "namespace": namespace})
+
+    async def drop_namespace(self, namespace):
+        if not namespace:
+            raise ValueError("Refusing to drop the default namespace")
+        await self._post("/vectors/delete", {"deleteAll": True, "namespace": namespace})
+
+    async def list_namespaces(self):
+        res = await self._post("/describe_index_stats", {})
+        return sorted((res.get("namespaces") or {}).keys())
+
+    async def list_ids(self, prefix, limit=100, token=None, namespace=""):
+        params = {"prefix": prefix, "limit": str(min(100, max(1, limit))), "namespace": namespace}
+        if token:
+            params["paginationToken"] = token
+        res = await self._request("GET", "/vectors/list", params=params)
+        ids = [v["id"] for v in res.get("vectors", [])]
+        return ids, (res.get("pagination") or {}).get("next")
+
+    async def fetch(self, ids, namespace=""):
+        out: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(ids), 100):
+            params = [("ids", vid) for vid in ids[i:i + 100]] + [("namespace", namespace)]
+            res = await self._request("GET", "/vectors/fetch", params=params)
+            for vid, v in (res.get("vectors") or {}).items():
+                out[vid] = {"values": v.get("values") or [], "metadata": v.get("metadata") or {}}
+        return out
+
+    async def delete_ids(self, ids, namespace=""):
+        for i in range(0, len(ids), 1000):
+            await self._post("/vectors/delete", {"ids": ids[i:i + 1000], "namespace": namespace})
+
+
+def _matches_filter(meta: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    for key, cond in filter.items():
+        value = meta.get(key)
+        if isinstance(cond, dict):
+            if "$eq" in cond and value != cond["$eq"]:
+                return False
+            if "$ne" in cond and value == cond["$ne"]:
+                return False
+            if "$in" in cond and value not in cond["$in"]:
+                return False
+            if "$nin" in cond and value in cond["$nin"]:
+                return False
+        elif value != cond:
+            return False
+    return True
+
+
+class _Partition:
+    def __init__(self, dimension: int, quantized: bool = False):
+        self.ids: List[str] = []
+        self.metas: List[Dict[str, Any]] = []
+        self.matrix = np.zeros((0, dimension), dtype=np.int8 if quantized else np.float32)
+        self.scales: Optional[np.ndarray] = np.zeros(0, dtype=np.float32) if quantized else None
+        self.pending = 0
+        self.on_disk = False
+
+    def __len__(self):
+        return len(self.ids)
+
+
+Key = Tuple[str, str, str]
+Job = Tuple[Key, Optional[List[str]], Optional[List[Dict[str, Any]]], Any, Optional[np.ndarray], Optional[List[Dict[str, Any]]]]
+
+
+class LocalStore(VectorStore):
+    def __init__(self, dimension: int, path: Optional[str] = LOCAL_VECTOR_DIR, dtype: str = LOCAL_VECTOR_DTYPE):
+        if dtype not in ("float32", "int8"):
+            raise RuntimeError(f"Unknown LOCAL_VECTOR_DTYPE: {dtype}")
+        self.dimension = dimension
+        self.quantized = dtype == "int8"
+        self._lock = threading.RLock()
+        self._io_lock = threading.Lock()
+        self._parts: Dict[Key, _Partition] = {}
+        self._by_chat: Dict[Tuple[str, str], Set[Key]] = {}
+        self._path = path if path and os.path.isdir(os.path.dirname(path.rstrip("/")) or ".") else None
+        if path and self._path is None:
+            logger.error(f"Local vector store directory {path!r} is not reachable; vectors will be kept in memory only")
+        self._loaded = self._path is None
+        self._exclusive = False
+        self._lock_file = None
+
+    def lock_exclusive(self):
+        if self._loaded and self._path is not None:
+            raise RuntimeError("lock_exclusive() must be called before the local vector store is loaded")
+        self._exclusive = True
+
+    @staticmethod
+    def _part_name(key: Key) -> str:
+        raw = "\x00".join(key[1:] if not key[0] else key)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+    @staticmethod
+    def _key(namespace: str, meta: Dict[str, Any]) -> Key:
+        return namespace, str(meta.get("bot_id")), str(meta.get("chat_id"))
+
+    async def warm(self) -> None:
+        await asyncio.to_thread(self._ensure_loaded)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                os.makedirs(self._path, exist_ok=True)
+                self._claim_dir()
+                self._load_catalog()
+                self._loaded = True
+
+    def _claim_dir(self):
+        if self._lock_file is not None:
+            return
+        f = open(os.path.join(self._path, ".lock"), "a")
+        try:
+            fcntl.flock(f, (fcntl.LOCK_EX if self._exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            if self._exclusive:
+                raise RuntimeError(
+                    f"Local vector store {self._path} is in use by a running bot; stop it first "
+                    f"or let the bot run maintenance itself (MAINTENANCE_IN_BOT=1)"
+                )
+            raise RuntimeError(f"Local vector store {self._path} is locked by a maintenance run")
+        self._lock_file = f
+
+    def _load_catalog(self):
+        for name in os.listdir(self._path):
+            if not name.endswith(".jsonl"):
+                continue
+            base = os.path.join(self._path, name[:-len(".jsonl")])
+            try:
+                part = _Partition(self.dimension, self.quantized)
+                namespace = ""
+                with open(base + ".jsonl", encoding="utf-8") as f:
+                    for line in f:
+                        row = json.loads(line)
+                        part.ids.append(row["id"])
+                        part.metas.append(row["metadata"])
+                        namespace = row.get("namespace", "")
+                if part.ids:
+                    part.matrix = np.load(base + ".npy", mmap_mode="r")
+                    part.scales = np.load(base + ".scales.npy") if os.path.exists(base + ".scales.npy") else None
+                    if part.matrix.shape[1] != self.dimension:
+                        logger.error(f"Local vector store skipped {name}: dimension {part.matrix.shape[1]} != {self.dimension}")
+                        continue
+                if os.path.exists(base + ".log"):
+                    self._replay(part, base + ".log")
+                if part.ids:
+                    self._conform(part)
+                    part.on_disk = True
+                    self._add_part(self._key(namespace, part.metas[0]), part)
+            except Exception as e:
+                logger.error(f"Local vector store load error ({name}): {e}", exc_info=True)
+
+    def _replay(self, part: _Partition, path: str):
+        rows = np.asarray(part.matrix, dtype=np.float32)
+        if part.scales is not None:
+            rows = rows * part.scales[:, None]
+        vecs = dict(zip(part.ids, rows))
+        metas = dict(zip(part.ids, part.metas))
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                part.pending += 1
+                if entry["op"] == "put":
+                    vec = np.asarray(entry["values"], dtype=np.float32)
+                    vecs[entry["id"]] = vec * entry["scale"] if "scale" in entry else vec
+                    metas[entry["id"]] = entry["metadata"]
+                else:
+                    for vid in entry["ids"]:
+                        vecs.pop(vid, None)
+                        metas.pop(vid, None)
+        part.ids = list(vecs)
+        part.metas = [metas[vid] for vid in part.ids]
+        part.matrix = np.asarray(list(vecs.values()), dtype=np.float32).reshape(len(part.ids), self.dimension)
+        part.scales = None
+
+    def _plan(self, key: Key, part: _Partition, log: List[Dict[str, Any]]) -> Optional[Job]:
+        if not self._path:
+            return None
+        if not len(part) or not part.on_disk or part.pending + len(log) >= LOCAL_SNAPSHOT_EVERY:
+            part.pending = 0
+            part.on_disk = bool(len(part))
+            return key, list(part.ids), list(part.metas), part.matrix, part.scales, None
+        part.pending += len(log)
+        return key, None, None, None, None, log
+
+    def _commit(self, mutate: Callable[[], List[Optional[Job]]]):
+        self._lock.acquire()
+        try:
+            jobs = [job for job in mutate() if job is not None]
+            if jobs:
+                self._io_lock.acquire()
+        finally:
+            self._lock.release()
+        if jobs:
+            try:
+                for job in jobs:
+                    self._write(*job)
+            finally:
+                self._io_lock.release()
+
+    def _write(self, key: Key, ids, metas, matrix, scales, log):
+        base = os.path.join(self._path, self._part_name(key))
+        if log is not None:
+            with open(base + ".log", "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in log)
+            return
+        if not ids:
+            for ext in (".npy", ".scales.npy", ".jsonl", ".log"):
+                if os.path.exists(base + ext):
+                    os.remove(base + ext)
+            return
+        extra = {"namespace": key[0]} if key[0] else {}
+        with open(base + ".npy.tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(matrix))
+        if scales is not None:
+            with open(base + ".scales.npy.tmp", "wb") as f:
+                np.save(f, scales)
+            os.replace(base + ".scales.npy.tmp", base + ".scales.npy")
+        elif os.path.exists(base + ".scales.npy"):
+            os.remove(base + ".scales.npy")
+        with open(base + ".jsonl.tmp", "w", encoding="utf-8") as f:
+            for vid, meta in zip(ids, metas):
+                f.write(json.dumps({"id": vid, "metadata": meta, **extra}, ensure_ascii=False) + "\n")
+        os.replace(base + ".npy.tmp", base + ".npy")
+        os.replace(base + ".jsonl.tmp", base + ".jsonl")
+        if os.path.exists(base + ".log"):
+            os.remove(base + ".log")
+
+    def _normalize(self, vecs: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vecs / norms).astype(np.float32, copy=False)
+
+    def _encode(self, rows: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        if not self.quantized:
+            return rows, None
+        scales = (np.abs(rows).max(axis=1) / 127.0).astype(np.float32)
+        scales[scales == 0] = 1.0
+        return np.rint(rows / scales[:, None]).astype(np.int8), scales
+
+    @staticmethod
+    def _row(part: _Partition, i: int) -> np.ndarray:
+        if part.scales is None:
+            return np.array(part.matrix[i], dtype=np.float32)
+        return part.matrix[i].astype(np.float32) * part.scales[i]
+
+    def _conform(self, part: _Partition):
+        if self.quantized and part.scales is None:
+            part.matrix, part.scales = self._encode(np.asarray(part.matrix, dtype=np.float32))
+        elif not self.quantized and part.scales is not None:
+            part.matrix = np.asarray(part.matrix, dtype=np.float32) * part.scales[:, None]
+            part.scales = None
+
+    def _add_part(self, key: Key, part: _Partition) -> _Partition:
+        self._parts[key] = part
+        self._by_chat.setdefault((key[0], key[2]), set()).add(key)
+        return part
+
+    def _remove_part(self, key: Key):
+        del self._parts[key]
+        keys = self._by_chat.get((key[0], key[2]))
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_chat[(key[0], key[2])]
+
+    def _namespace(self, namespace: str):
+        return [(key, part) for key, part in self._parts.items() if key[0] == namespace]
+
+    def _partitions_for(self, filter: Dict[str, Any], namespace: str = ""):
+        bot_id, chat_id = filter.get("bot_id"), filter.get("chat_id")
+        if isinstance(bot_id, str) and isinstance(chat_id, str):
+            key = (namespace, bot_id, chat_id)
+            part = self._parts.get(key)
+            extra = {k: v for k, v in filter.items() if k not in ("bot_id", "chat_id")}
+            return ([(key, part)] if part is not None else []), extra
+        if isinstance(chat_id, str):
+            keys = sorted(self._by_chat.get((namespace, chat_id), ()))
+            extra = {k: v for k, v in filter.items() if k != "chat_id"}
+            return [(key, self._parts[key]) for key in keys], extra
+        return self._namespace(namespace), dict(filter)
+
+    async def upsert(self, vectors: List[Vector], namespace: str = "") -> None:
+        await asyncio.to_thread(self._upsert, vectors, namespace)
+
+    def _upsert(self, vectors: List[Vector], namespace: str = "") -> None:
+        self._ensure_loaded()
+        grouped: Dict[Key, List[Vector]] = {}
+        for v in vectors:
+            grouped.setdefault(self._key(namespace, v[2] or {}), []).append(v)
+
+        encoded = {}
+        for key, items in grouped.items():
+            codes, new_scales = self._encode(self._normalize(np.asarray([v[1] for v in items], dtype=np.float32)))
+            log = []
+            for j, (vid, _, meta) in enumerate(items):
+                entry = {"op": "put", "id": vid, "metadata": meta, "values": codes[j].tolist()}
+                if new_scales is not None:
+                    entry["scale"] = float(new_scales[j])
+                log.append(entry)
+            encoded[key] = codes, new_scales, log
+
+        def mutate() -> List[Optional[Job]]:
+            jobs = []
+            for key, items in grouped.items():
+                codes, new_scales, log = encoded[key]
+                part = self._parts.get(key)
+                if part is None:
+                    part = self._add_part(key, _Partition(self.dimension, self.quantized))
+                positions = {vid: i for i, vid in enumerate(part.ids)}
+                matrix = np.array(part.matrix)
+                scales = None if part.scales is None else np.array(part.scales)
+                appended = []
+                for j, (vid, _, meta) in enumerate(items):
+                    if vid in positions:
+                        matrix[positions[vid]] = codes[j]
+                        if scales is not None:
+                            scales[positions[vid]] = new_scales[j]
+                        part.metas[positions[vid]] = meta
+                    else:
+                        positions[vid] = len(part.ids)
+                        part.ids.append(vid)
+                        part.metas.append(meta)
+                        appended.append(j)
+                if appended:
+                    matrix = np.vstack([matrix, codes[appended]])
+                    if scales is not None:
+                        scales = np.concatenate([scales, new_scales[appended]])
+                part.matrix, part.scales = matrix, scales
+                jobs.append(self._plan(key, part, log))
+            return jobs
+
+        self._commit(mutate)
+
+    async def query(self, vector, filter, top_k, include_values=False, namespace=""):
+        return await asyncio.to_thread(self._query, vector, filter, top_k, include_values, namespace)
+
+    def _query(self, vector, filter, top_k, include_values=False, namespace=""):
+        self._ensure_loaded()
+        q = self._normalize(np.asarray([vector], dtype=np.float32))[0]
+
+        with self._lock:
+            parts, extra = self._partitions_for(filter, namespace)
+            candidates = []
+            for _, part in parts:
+                if not len(part):
+                    continue
+                if part.scales is None:
+                    scores = np.asarray(part.matrix) @ q
+                else:
+                    scores = (part.matrix.astype(np.float32) @ q) * part.scales
+                if extra:
+                    mask = np.fromiter((_matches_filter(m, extra) for m in part.metas), dtype=bool, count=len(part))
+                    scores = np.where(mask, scores, -np.inf)
+                k = min(top_k, len(part))
+                idx = np.argpartition(-scores, k - 1)[:k] if k < len(part) else np.arange(len(part))
+                for i in idx:
+                    if np.isfinite(scores[i]):
+                        candidates.append((float(scores[i]), part, int(i)))
+
+            candidates.sort(key=lambda x: x[0], reverse=True)
+            matches = []
+            for score, part, i in candidates[:top_k]:
+                matches.append({
+                    "id": part.ids[i],
+                    "score": score,
+                    "metadata": dict(part.metas[i]),
+                    "values": self._row(part, i) if include_values else [],
+                })
+        return {"matches": matches}
+
+    async def delete(self, filter, namespace=""):
+        await asyncio.to_thread(self._delete, filter, namespace)
+
+    async def drop_namespace(self, namespace):
+        if not namespace:
+            raise ValueError("Refusing to drop the default namespace")
+        await asyncio.to_thread(self._drop_namespace, namespace)
+
+    def _drop_namespace(self, namespace):
+        self._ensure_loaded()
+        self._commit(lambda: [self._retain(key, part, []) for key, part in self._namespace(namespace)])
+
+    async def list_namespaces(self):
+        return await asyncio.to_thread(self._list_namespaces)
+
+    def _list_namespaces(self):
+        self._ensure_loaded()
+        with self._lock:
+            return sorted({key[0] for key in self._parts})
+
+    async def list_ids(self, prefix, limit=100, token=None, namespace=""):
+        return await asyncio.to_thread(self._list_ids, prefix, limit, token, namespace)
+
+    def _list_ids(self, prefix, limit=100, token=None, namespace=""):
+        self._ensure_loaded()
+        with self._lock:
+            ids = sorted(vid for _, part in self._namespace(namespace) for vid in part.ids if vid.startswith(prefix))
+        start = int(token or 0)
+        end = start + max(1, limit)
+        return ids[start:end], (str(end) if end < len(ids) else None)
+
+    async def fetch(self, ids, namespace=""):
+        return await asyncio.to_thread(self._fetch, ids, namespace)
+
+    def _fetch(self, ids, namespace=""):
+        self._ensure_loaded()
+        wanted = set(ids)
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for _, part in self._namespace(namespace):
+                for i, vid in enumerate(part.ids):
+                    if vid in wanted:
+                        out[vid] = {"values": self._row(part, i), "metadata": dict(part.metas[i])}
+        return out
+
+    async def delete_ids(self, ids, namespace=""):
+        await asyncio.to_thread(self._delete_ids, set(ids), namespace)
+
+    def _delete_ids(self, ids, namespace=""):
+        self._ensure_loaded()
+
+        def mutate() -> List[Optional[Job]]:
+            jobs = []
+            for key, part in self._namespace(namespace):
+                keep = [i for i, vid in enumerate(part.ids) if vid not in ids]
+                if len(keep) != len(part):
+                    jobs.append(self._retain(key, part, keep))
+            return jobs
+
+        self._commit(mutate)
+
+    def _delete(self, filter, namespace=""):
+        self._ensure_loaded()
+
+        def mutate() -> List[Optional[Job]]:
+            jobs = []
+            parts, extra = self._partitions_for(filter, namespace)
+            for key, part in parts:
+                keep = [i for i, m in enumerate(part.metas) if not _matches_filter(m, extra)] if extra else []
+                if len(keep) != len(part):
+                    jobs.append(self._retain(key, part, keep))
+            return jobs
+
+        self._commit(mutate)
+
+    def _retain(self, key: Key, part: _Partition, keep: List[int]) -> Optional[Job]:
+        kept = set(keep)
+        removed = [vid for i, vid in enumerate(part.ids) if i not in kept]
+        part.ids = [part.ids[i] for i in keep]
+        part.metas = [part.metas[i] for i in keep]
+        part.matrix = np.array(np.asarray(part.matrix)[keep]).reshape(len(keep), self.dimension)
+        if part.scales is not None:
+            part.scales = np.array(part.scales[keep], dtype=np.float32)
+        if not len(part):
+            self._remove_part(key)
+        return self._plan(key, part, [{"op": "del", "ids": removed}])
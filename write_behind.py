@@ -0,0 +1,164 @@
+import os
+import random
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from scheduler import BACKGROUND, set_lane
+
+logger = logging.getLogger(__name__)
+
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "32"))
+PERSIST_FLUSH_SEC = float(os.getenv("PERSIST_FLUSH_SEC", "1.0"))
+PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "4"))
+PERSIST_BACKOFF_SEC = float(os.getenv("PERSIST_BACKOFF_SEC", "0.5"))
+PERSIST_DRAIN_TIMEOUT_SEC = float(os.getenv("PERSIST_DRAIN_TIMEOUT_SEC", "30"))
+PERSIST_MAX_BLOCKED_SEC = float(os.getenv("PERSIST_MAX_BLOCKED_SEC", "300"))
+
+_CLOSE = object()
+
+FlushFn = Callable[[List[Dict[str, Any]]], Awaitable[bool]]
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        flush_fn: FlushFn,
+        max_batch: int = PERSIST_BATCH_SIZE,
+        max_delay: float = PERSIST_FLUSH_SEC,
+        max_retries: int = PERSIST_MAX_RETRIES,
+        backoff: float = PERSIST_BACKOFF_SEC,
+        blocked: Optional[Callable[[], bool]] = None,
+        max_blocked: float = PERSIST_MAX_BLOCKED_SEC,
+    ):
+        self._flush_fn = flush_fn
+        self._blocked = blocked
+        self.max_blocked = max(0.0, max_blocked)
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay)
+        self.max_retries = max(0, max_retries)
+        self.backoff = max(0.0, backoff)
+        self._q: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._batch: List[Dict[str, Any]] = []
+        self._flushing: Optional[asyncio.Future] = None
+        self._flushing_chats: Set[str] = set()
+        self.flushed = 0
+        self.dropped = 0
+
+    def depth(self) -> int:
+        return self._q.qsize() if self._q is not None else 0
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._q = asyncio.Queue()
+        self._closing = False
+        self._task = asyncio.create_task(self._run(), name="write-behind")
+
+    def submit(self, record: Optional[Dict[str, Any]]) -> bool:
+        if record is None:
+            return False
+        if self._q is None or self._closing:
+            logger.error("Write-behind queue is not running; dropping record")
+            self.dropped += 1
+            return False
+        self._q.put_nowait(record)
+        return True
+
+    async def discard(self, chat_id: str) -> int:
+        chat_id = str(chat_id)
+
+        def keep(r) -> bool:
+            return r is _CLOSE or str(r["meta"]["chat_id"]) != chat_id
+
+        removed = 0
+        if self._q is not None:
+            items = []
+            while not self._q.empty():
+                items.append(self._q.get_nowait())
+            for item in items:
+                if keep(item):
+                    self._q.put_nowait(item)
+                else:
+                    removed += 1
+        before = len(self._batch)
+        self._batch[:] = [r for r in self._batch if keep(r)]
+        removed += before - len(self._batch)
+        while self._flushing is not None and chat_id in self._flushing_chats:
+            await asyncio.shield(self._flushing)
+        return removed
+
+    async def close(self, timeout: float = PERSIST_DRAIN_TIMEOUT_SEC):
+        if self._task is None:
+            return
+        self._closing = True
+        self._q.put_nowait(_CLOSE)
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Write-behind drain timed out; {self.depth()} records not persisted")
+            self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        set_lane(BACKGROUND)
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            first = await self._q.get()
+            if first is _CLOSE:
+                break
+            self._batch = batch = [first]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if self._q.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0 or closing:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._q.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._q.get_nowait()
+                if item is _CLOSE:
+                    closing = True
+                    continue
+                batch.append(item)
+            await self._flush(batch)
+            self._batch = []
+
+    def _is_blocked(self) -> bool:
+        return self._blocked is not None and self._blocked()
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        loop = asyncio.get_running_loop()
+        give_up_at = loop.time() + self.max_blocked
+        attempt = 0
+        while batch:
+            self._flushing = loop.create_future()
+            self._flushing_chats = {str(r["meta"]["chat_id"]) for r in batch}
+            try:
+                if await self._flush_fn(list(batch)):
+                    self.flushed += len(batch)
+                    return
+            except Exception as e:
+                logger.error(f"Write-behind flush error: {e}", exc_info=True)
+            finally:
+                self._flushing.set_result(None)
+                self._flushing, self._flushing_chats = None, set()
+            if self._is_blocked() and loop.time() < give_up_at:
+                while batch and self._is_blocked() and loop.time() < give_up_at:
+                    await asyncio.sleep(max(0.05, self.backoff))
+                continue
+            if attempt >= self.max_retries:
+                break
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        if not batch:
+            return
+        self.dropped += len(batch)
+        logger.error(f"Write-behind gave up on {len(batch)} records after {attempt + 1} attempts")